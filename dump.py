@@ -27,22 +27,9 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 import argparse
-import os
-import traceback
+import sys
 import dumpdisc
 import dumpdisc.image
-import dumpdisc.common
-
-def tree(partition):
-	print("> {} ({})".format(partition.label, partition.type))
-	pending = [(entry, 1) for entry in partition.root_directory.directories + partition.root_directory.files]
-	while len(pending) > 0:
-		entry, depth = pending.pop(0)
-		
-		print("{}{} {}".format(" " * 4 * depth, "+" if isinstance(entry, dumpdisc.common.Directory) else "-", entry.name))
-		
-		if isinstance(entry, dumpdisc.common.Directory):
-			pending[0:0] = map(lambda e: (e, depth + 1), entry.directories + entry.files)
 
 parser = argparse.ArgumentParser(description="Extract the files of all filesystems found in a disc image")
 group = parser.add_mutually_exclusive_group()
@@ -52,13 +39,26 @@ parser.add_argument('-b' '--badmap', help="Use specified file with bad sectors",
 group = parser.add_mutually_exclusive_group()
 group.add_argument('-s', '--start', help="Data track start sector (useful when the image is of a whole mixed CD)", type=int, dest="start", required=False, default=0)
 group.add_argument('-o', '--offset', help="Image base sector offset (useful when the image is of the data portion of a mixed CD)", type=int, dest="offset", required=False, default=0)
+parser.add_argument('-n', '--names-only', help="Only print the name of each file and directory", dest="names_only", action="store_true", default=False, required=False)
+parser.add_argument('-V', '--verify', help="Only check the EDC/ECC of every sector of a RAW image and list the invalid ones", dest="verify", action="store_true", default=False, required=False)
 parser.add_argument('image', help="Image file name", type=str)
 args = parser.parse_args()
+if args.verify and not args.rawimage:
+	parser.error("--verify is only valid for raw images")
+
+# output is written one line per entry, avoid a write() call for each one
+sys.stdout.reconfigure(line_buffering=False)
 
 f = open(args.image, "rb")
 start = 0
 cls = dumpdisc.image.RawCDImage if args.rawimage else dumpdisc.image.ISOImage
 image = cls(f)
+if args.verify:
+	with image:
+		errors = image.verify_all()
+	for sector, error in errors:
+		print("{}: {}".format(sector, error))
+	sys.exit(1 if len(errors) > 0 else 0)
 if args.offset != 0:
 	image = dumpdisc.image.OffsetedImage(image, args.offset)
 	start = args.offset
@@ -72,11 +72,13 @@ if args.start != 0:
 with image:
 	disc = dumpdisc.Disc(image, start)
 	for partition in disc.partitions:
-		print(partition.dump())
-		pending = [(partition.root_directory, 1), ]
-		while len(pending) > 0:
-			entry, depth = pending.pop(0)
+		if args.names_only:
+			dumpdisc.tree(partition)
+			continue
+		for chunk in partition.dump_iter():
+			sys.stdout.write(chunk)
+		sys.stdout.write("\n")
+		print(partition.root_directory.dump(1))
+		for entry, depth in dumpdisc.common.walk(partition.root_directory, 2):
 			print(entry.dump(depth))
-			if isinstance(entry, dumpdisc.common.Directory):
-				pending[0:0] = map(lambda e: (e, depth + 1), entry.directories + entry.files)
 
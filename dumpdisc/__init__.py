@@ -26,26 +26,57 @@
 # OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-import traceback
+import sys
+import threading
 from . import common
 from . import iso9660
 from . import apple
+from .image import SynchronizedImage
 
 class Disc(common.Dumpeable):
+	_FILESYSTEMS = (iso9660.ISO9660, apple.Volume)
+	
 	def __init__(self, image, base_offset=0):
 		self._partitions = []
 		
-		for cls in (iso9660.ISO9660, apple.Volume):
+		# probe every filesystem at the same time so the reads done by one of them
+		# overlap with the parsing done by the others
+		# (plain threads are used as concurrent.futures pulls logging and traceback on import)
+		image = SynchronizedImage(image)
+		results = [None] * len(self._FILESYSTEMS)
+		def probe(index, cls):
 			try:
-				volume = cls(image, base_offset)
-				self._partitions.extend(volume.partitions)
+				results[index] = cls.probe(image, base_offset)
 			except Exception as e:
-				traceback.print_exc()
+				results[index] = e
+		threads = [threading.Thread(target=probe, args=(index, cls)) for index, cls in enumerate(self._FILESYSTEMS)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		for cls, result in zip(self._FILESYSTEMS, results):
+			if isinstance(result, Exception):
+				print("WARNING: couldn't probe {}.{} ({})".format(cls.__module__, cls.__name__, str(result)), file=sys.stderr)
+			elif result != None:
+				self._partitions.extend(result.partitions)
 	
 	@property
 	def partitions(self):
 		return tuple(self._partitions)
 	
+	def dump_iter(self, indent=0):
+		yield self._TAB * indent + "Disc:"
+		for partition in self._partitions:
+			yield "\n"
+			yield from partition.dump_iter(indent + 1)
+	
 	def dump(self, indent=0):
-		return self._TAB * indent + "Disc:" + \
-			"".join(["\n" + partition.dump(indent + 1) for partition in self._partitions])
\ No newline at end of file
+		return "".join(self.dump_iter(indent))
+
+_INDENTS = [" " * 4 * depth for depth in range(64)]
+
+def tree(partition):
+	print("> {} ({})".format(partition.label, partition.type))
+	for entry, depth in common.walk(partition.root_directory):
+		indent = _INDENTS[depth] if depth < len(_INDENTS) else " " * 4 * depth
+		print(f"{indent}{'+' if entry.IS_DIR else '-'} {entry.name}")
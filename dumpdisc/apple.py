@@ -27,8 +27,10 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 import datetime
+import functools
 import struct
 from . import common
+from .image import CachedImage
 
 
 # https://github.com/libyal/libfshfs/blob/main/documentation/Hierarchical%20File%20System%20(HFS).asciidoc#volume_attribute_flags
@@ -43,18 +45,24 @@ def _to_datetime(apple_timestamp):
 	return datetime.datetime.fromtimestamp(apple_timestamp - 0x7C25B080)
 	
 def _to_string(buffer):
-	return buffer.decode("ascii")
-	
+	return str(buffer, "ascii")
+
+_UINT16 = struct.Struct(">H")
+_UINT32 = struct.Struct(">I")
+_BLOCK0 = struct.Struct(">2sHIHHIH64s430s")
+
 class Volume(common.FileSystem, common.Dumpeable):
 	def __init__(self, image, base_offset=0):
 		self._image = image
 		self._base_offset = base_offset
 		self._block_size = 512
+		# several apple blocks share each image block, keep the recently read ones
+		self._cached_image = CachedImage(image, 256)
 		
 		# block0
 		data = self.read_blocks(0)
 		signature, self._block_size, self._block_count, self._device_type, self._device_id, self._driver_data, driver_descriptor_count, driver_descriptor_table, unused1 = \
-			struct.unpack(">2sHIHHIH64s430s", data)
+			_BLOCK0.unpack_from(data, 0)
 			
 		if signature != b"ER":
 			raise ValueError("invalid signature for apple volume block0")
@@ -66,14 +74,37 @@ class Volume(common.FileSystem, common.Dumpeable):
 		data = self.read_blocks(1)
 		self._partition_map = Partition.from_sector(data, self)
 		
+	@classmethod
+	def probe(cls, image, base_offset=0):
+		if image.read_blocks_data(base_offset)[:2] != b"ER":
+			return None
+		return cls(image, base_offset)
+		
 	def read_blocks(self, address, count=1):
+		data = bytearray(count * self.block_size)
+		self.read_blocks_into(address, count, memoryview(data))
+		return data
+		
+	def read_blocks_into(self, address, count, data):
 		block_index = (address * self.block_size) // self._image.block_size
 		block_offset = (address * self.block_size) % self._image.block_size
-		data = self._image.read_blocks_data(self._base_offset + block_index)[block_offset:]
-		while len(data) < count * self.block_size:
-			block_index += 1
-			data += self._image.read_blocks_data(self._base_offset + block_index)
-		return data[:count * self.block_size]
+		size = count * self.block_size
+		block_count = (block_offset + size + self._image.block_size - 1) // self._image.block_size
+		# reads within a single image block go through the cache, longer ones (file contents)
+		# are done with one image read
+		if block_count == 1:
+			blocks = self._cached_image.read_blocks_data(self._base_offset + block_index)
+		elif block_offset == 0 and size % self._image.block_size == 0:
+			# whole image blocks are read straight into the buffer
+			if self._image.read_blocks_data_into(self._base_offset + block_index, block_count, data) != size:
+				raise ValueError("read past apple volume end")
+			return
+		else:
+			blocks = self._image.read_blocks_data(self._base_offset + block_index, block_count)
+		blocks = memoryview(blocks)[block_offset:block_offset + size]
+		if len(blocks) != size:
+			raise ValueError("read past apple volume end")
+		data[:size] = blocks
 			
 	@property
 	def block_size(self):
@@ -83,14 +114,20 @@ class Volume(common.FileSystem, common.Dumpeable):
 	def partitions(self):
 		return self._partition_map._partitions
 	
+	def dump_iter(self, indent=0):
+		tab = self._TAB * indent
+		yield tab + "AppleVolume:\n" + \
+			tab + "- Block Size: {}\n".format(self._block_size) + \
+			tab + "- Block Count: {}\n".format(self._block_count) + \
+			tab + "- Device Type: {}\n".format(self._device_type) + \
+			tab + "- Device Id: {}\n".format(self._device_id) + \
+			tab + "- Driver Data: {}\n".format(self._driver_data)
+		yield from self._partition_map.dump_iter(indent + 1)
+		
 	def dump(self, indent=0):
-		return self._TAB * indent + "AppleVolume:\n" + \
-			self._TAB * indent + "- Block Size: {}\n".format(self._block_size) + \
-			self._TAB * indent + "- Block Count: {}\n".format(self._block_count) + \
-			self._TAB * indent + "- Device Type: {}\n".format(self._device_type) + \
-			self._TAB * indent + "- Device Id: {}\n".format(self._device_id) + \
-			self._TAB * indent + "- Driver Data: {}\n".format(self._driver_data) + \
-			self._partition_map.dump(indent + 1)
+		return "".join(self.dump_iter(indent))
+
+_PARTITION_MAP_ENTRY = struct.Struct(">2s2sIII32s32sIII420s")
 
 class Partition(common.Dumpeable):
 	def __init__(self, partition_count, start_block, block_count, name, logical_block_start, logical_block_count, flags, volume):
@@ -106,6 +143,9 @@ class Partition(common.Dumpeable):
 	def read_blocks(self, address, count=1):
 		return self._volume.read_blocks(self._start_block + address, count)
 	
+	def read_blocks_into(self, address, count, data):
+		self._volume.read_blocks_into(self._start_block + address, count, data)
+	
 	def dump(self, indent=0):
 		return self._TAB * indent + "{} ({}):\n".format(self.__class__.__name__, self.type) + \
 			self._TAB * indent + "- Partition Count: {}\n".format(self._partition_count) + \
@@ -124,7 +164,7 @@ class Partition(common.Dumpeable):
 	@classmethod
 	def from_sector(cls, data, volume):
 		signature, unused2, partition_count, start_block, block_count, name, _type, logical_block_start, logical_block_count, flags, unused3 = \
-			struct.unpack(">2s2sIII32s32sIII420s", data)
+			_PARTITION_MAP_ENTRY.unpack_from(data, 0)
 
 		if signature != b"PM":
 			raise ValueError("invalid signature for apple block1")
@@ -132,39 +172,50 @@ class Partition(common.Dumpeable):
 		name = name.decode("ascii").rstrip("\x00")
 		_type = _type.decode("ascii").rstrip("\x00")
 		
-		for c in cls.__subclasses__():
-			if c.get_type() == _type:
-				return c(partition_count, start_block, block_count, name, logical_block_start, logical_block_count, flags, volume)
+		c = _PARTITIONS.get(_type)
+		if c != None:
+			return c(partition_count, start_block, block_count, name, logical_block_start, logical_block_count, flags, volume)
 		raise ValueError("unknown apple partition type ({})".format(_type))
 		
 class PartitionMap(Partition):
 	def __init__(self, partition_count, start_block, block_count, name, logical_block_start, logical_block_count, flags, volume):
 		super().__init__(partition_count, start_block, block_count, name, logical_block_start, logical_block_count, flags, volume)
 		
-		self._partitions = []
+		partitions = []
 		for i in range(self._partition_count - 1):
 			data = self.read_blocks(1 + i)
 			partition = Partition.from_sector(data, volume)
-			self._partitions.append(partition)
+			partitions.append(partition)
+		self._partitions = tuple(partitions)
 			
 	@property
 	def partitions(self):
-		return tuple(self._partitions)
+		return self._partitions
+	
+	def dump_iter(self, indent=0):
+		yield super().dump(indent) + "\n" + \
+			self._TAB * indent + "- Partitions:\n"
+		separator = ""
+		for partition in self._partitions:
+			yield separator
+			yield from partition.dump_iter(indent + 1)
+			separator = "\n"
 	
 	def dump(self, indent=0):
-		return super().dump(indent) + "\n" + \
-			self._TAB * indent + "- Partitions:\n" + \
-			"\n".join([partition.dump(indent + 1) for partition in self._partitions])
+		return "".join(self.dump_iter(indent))
 
 	@classmethod
 	def get_type(cls):
 		return "Apple_partition_map"
 		
+_MASTER_DIRECTORY_BLOCK = struct.Struct(">2sIIHHHHHIIHIHB27s4sHIIIHII32s2s4sI12sI12s")
+
 class HFSPartition(Partition, common.Partition):
 	def __init__(self, partition_count, start_block, block_count, name, logical_block_start, logical_block_count, flags, volume):
 		super().__init__(partition_count, start_block, block_count, name, logical_block_start, logical_block_count, flags, volume)
 		
-		data = self.read_blocks(0, 2)	
+		# boot blocks and master directory block
+		data = memoryview(self.read_blocks(0, 3))
 		"""
 		signature, self._boot_entry_point, self._boot_version, self._page_flags, \
 			system_filename, shell_filename, debugger1_filename, debugger2_filename, startup_screen, startup_program, scrap_filename, \
@@ -183,13 +234,12 @@ class HFSPartition(Partition, common.Partition):
 		self._scrap_filename = scrap_filename.decode("ascii").rstrip("\x00")
 		"""
 		
-		data = self.read_blocks(2)
 		signature, volume_creation_timestamp, volume_modification_timestamp, self._volume_attribute_flags, self._root_directory_files, self._volume_bitmap_block, \
 			unused1, self._allocation_blocks, self._allocation_block_size, self._default_clump_size, self._extents_start_block, self._next_catalog_node_identifier, \
 			self._unused_allocation_blocks, volume_label_size, volume_label, backup_datetime, self._backup_sequence, self._volume_wrtie_count, \
 			self._extents_clump_size, self._catalog_clump_size, self._root_directory_directories, self._total_files, self._total_directories, \
 			finder_information, self._volume_signature, extent_descriptor, self._extents_file_size, extents_record, self._catalog_file_size, catalog_extent_records = \
-			struct.unpack(">2sIIHHHHHIIHIHB27s4sHIIIHII32s2s4sI12sI12s", data[:162])
+			_MASTER_DIRECTORY_BLOCK.unpack_from(data, 2 * volume.block_size)
 			
 		if signature != b"BD":
 			raise ValueError("invalid signature for HFS master directory block {}".format(repr(signature)))
@@ -207,8 +257,12 @@ class HFSPartition(Partition, common.Partition):
 		
 		self._extents = ExtentGroup(extents_record, 3, self)
 
-	def read_extent_blocks(self, address, count):
-		return self.read_blocks(self._extents_start_block + address * self._allocation_block_size // self._volume.block_size, count * self._allocation_block_size // self._volume.block_size)
+	def read_extent_blocks_into(self, address, count, data):
+		self.read_blocks_into(self._extents_start_block + address * self._allocation_block_size // self._volume.block_size, count * self._allocation_block_size // self._volume.block_size, data)
+	
+	@property
+	def allocation_block_size(self):
+		return self._allocation_block_size
 	
 	@property
 	def type(self):
@@ -222,8 +276,8 @@ class HFSPartition(Partition, common.Partition):
 	def root_directory(self):
 		return self._catalog_file.root_directory
 
-	def dump(self, indent=0):
-		return super().dump(indent) + "\n" + \
+	def dump_iter(self, indent=0):
+		yield super().dump(indent) + "\n" + \
 			self._TAB * indent + "- Volume Creation: {}\n".format(self._volume_creation_datetime.isoformat()) + \
 			self._TAB * indent + "- Volume Modification: {}\n".format(self._volume_modification_datetime.isoformat()) + \
 			self._TAB * indent + "- Volume Attribute Flags: {}\n".format(self._volume_attribute_flags) + \
@@ -247,51 +301,59 @@ class HFSPartition(Partition, common.Partition):
 			self._TAB * indent + "- Extents:\n" + \
 			self._extents.dump(indent + 1) + "\n" + \
 			self._TAB * indent + "- Catalog File Size: {}\n".format(self._catalog_file_size) + \
-			self._TAB * indent + "- Catalog File:\n" + \
-			self._catalog_file.dump(indent + 1)
+			self._TAB * indent + "- Catalog File:\n"
+		yield from self._catalog_file.dump_iter(indent + 1)
+		
+	def dump(self, indent=0):
+		return "".join(self.dump_iter(indent))
 
 	@classmethod
 	def get_type(cls):
 		return "Apple_HFS"
 
+# partition classes by type, from_sector looks them up here
+_PARTITIONS = {c.get_type(): c for c in reversed(Partition.__subclasses__())}
+
+_EXTENT = struct.Struct(">HH")
+
 class ExtentGroup(common.Dumpeable):
 	def __init__(self, data, count, partition):
 		if len(data) != count * 4:
 			raise ValueError("incorrect data size for apple extent group")
 		
-		self._extents = [struct.unpack(">HH", data[index * 4:(index + 1) * 4]) for index in range(count)]
+		extents = list(_EXTENT.iter_unpack(data))
+		self._starts = tuple([start for start, size in extents])
+		self._sizes = tuple([size for start, size in extents])
+		self._size = sum(self._sizes)
 		self._partition = partition
 		
-	def read_blocks(self, address, count):
-		result = b""
-		for start, size in self._extents:
-			if address < size:
-				chunk_size = count if address + count <= size else size - address
-				result += self._partition.read_extent_blocks(start + address, chunk_size)
-				count -= chunk_size
-			if count == 0:
-				return result
-			address -= size
-		raise ValueError("read past extent group end")
-	
 	def read_all_blocks(self):
-		return b"".join([self._partition.read_extent_blocks(start, size) for start, size in self._extents if size > 0])
+		block_size = self._partition.allocation_block_size
+		data = bytearray(self._size * block_size)
+		view = memoryview(data)
+		position = 0
+		for start, size in zip(self._starts, self._sizes):
+			if size > 0:
+				self._partition.read_extent_blocks_into(start, size, view[position:position + size * block_size])
+				position += size * block_size
+		return data
 		
 	@property
 	def size(self):
-		return sum([size for start, size in self._extents])
+		return self._size
 
 	def dump(self, indent=0):
 		return self._TAB * indent + "AppleExtentGroup:\n" + \
 			"\n".join([ \
 				self._TAB * indent + "- Start Block: {}\n".format(start) + \
 				self._TAB * indent + "- Block Count: {}".format(count) \
-				for start, count in self._extents])
+				for start, count in zip(self._starts, self._sizes)])
 
 class CatalogFile(common.Dumpeable):
 	def __init__(self, extents, partition):
 		self._partition = partition
 		self._btree = BTree(extents, self)
+		self._parent_index = None
 			
 	def build_key(self, data):
 		return CatalogKey(data)
@@ -300,11 +362,22 @@ class CatalogFile(common.Dumpeable):
 		return CatalogRecord.from_key_data(key, data)
 		
 	def get_extent_contents(self, extents_records, size):
-		extents = ExtentGroup(extents_records, 3, self._partition)
-		return extents.read_all_blocks()[:size]
+		return ExtentGroup(extents_records, 3, self._partition).read_all_blocks()[:size]
+		
+	def _build_parent_index(self):
+		# a walk of the whole tree lists every directory, so group all the records by parent
+		# once instead of searching the tree for each directory
+		parent_index = {}
+		for key, data in self._btree.iter_entries():
+			parent_index.setdefault(key._parent_identifier, []).append((key, data))
+		self._parent_index = parent_index
 		
 	def _get_childs(self, identifier, _type):
-		return filter(lambda record: isinstance(record, _type), self._btree.search(CatalogSearchKeyByParentIdentifier(identifier)))
+		if self._parent_index == None:
+			self._build_parent_index()
+		# only the records of the requested type are built, the first byte of the data is the type
+		record_type = _type.get_type()
+		return (self.build_record(key, data) for key, data in self._parent_index.get(identifier, ()) if data[0] == record_type)
 	
 	def get_directories(self, identifier):
 		return self._get_childs(identifier, CatalogDirectoryRecord)
@@ -316,19 +389,34 @@ class CatalogFile(common.Dumpeable):
 	def root_directory(self):
 		return Directory(next(self.get_directories(1)), self)
 
+	def dump_iter(self, indent=0):
+		yield self._TAB * indent + "AppleCatalogFile:\n"
+		yield from self._btree.dump_iter(indent + 1)
+		
 	def dump(self, indent=0):
-		return self._TAB * indent + "AppleCatalogFile:\n" + \
-			self._btree.dump(indent + 1)
+		return "".join(self.dump_iter(indent))
 			
+_CATALOG_KEY = struct.Struct(">BBIB")
+
 class CatalogKey(common.Dumpeable):
 	def __init__(self, data):
-		size, unused, self._parent_identifier, name_size = struct.unpack(">BBIB", data[:7])
-		self._name = _to_string(data[7:7 + name_size])
+		size, unused, self._parent_identifier, name_size = _CATALOG_KEY.unpack_from(data, 0)
+		# most keys are only compared by parent identifier, decode the name when it is used
+		self._raw_name = data[7:7 + name_size]
+		self._name = None
+		
+	@property
+	def name(self):
+		if self._name == None:
+			self._name = _to_string(self._raw_name)
+		return self._name
 		
 	def dump(self, indent=0):
 		return self._TAB * indent + "AppleCatalogKey:\n" + \
 			self._TAB * indent + "- Parent Identifier: {}\n".format(self._parent_identifier) + \
-			self._TAB * indent + "- Name: {}".format(self._name)
+			self._TAB * indent + "- Name: {}".format(self.name)
+
+_CATALOG_RECORD_HEADER = struct.Struct(">BB")
 
 class CatalogRecord(common.Dumpeable):
 	def __init__(self, key, data):
@@ -340,26 +428,28 @@ class CatalogRecord(common.Dumpeable):
 		
 	@classmethod
 	def from_key_data(cls, key, data):
-		_type, unused = struct.unpack(">BB", data[:2])
+		_type, unused = _CATALOG_RECORD_HEADER.unpack_from(data, 0)
 		
 		if unused != 0:
 			raise ValueError("invalid catalog record")
 		
-		for c in cls.__subclasses__():
-			if c.get_type() == _type:
-				return c(key, data)
+		c = _CATALOG_RECORDS.get(_type)
+		if c != None:
+			return c(key, data)
 				
 		raise ValueError("unknown catalog record type ({})".format(data.hex()))
 		
+_CATALOG_DIRECTORY_RECORD = struct.Struct(">HHHIIII16s16s16s")
+
 class CatalogDirectoryRecord(CatalogRecord):
 	def __init__(self, key, data):
-		self._name = key._name
+		self._key = key
 		_type, self._flags, self._entry_count, self._identifier, creation_timestamp, modification_timestamp, backup_timestamp, \
-			self._folder_information, self._extended_folder_information, unused = struct.unpack(">HHHIIII16s16s16s", data[:70])
+			self._folder_information, self._extended_folder_information, unused = _CATALOG_DIRECTORY_RECORD.unpack_from(data, 0)
 
 	@property
 	def name(self):
-		return self._name
+		return self._key.name
 	
 	@property
 	def identifier(self):
@@ -367,7 +457,7 @@ class CatalogDirectoryRecord(CatalogRecord):
 		
 	def dump(self, indent=0):
 		return self._TAB * indent + "AppleCatalogDirectoryRecord:\n" + \
-			self._TAB * indent + "- Name: {}\n".format(self._name) + \
+			self._TAB * indent + "- Name: {}\n".format(self.name) + \
 			self._TAB * indent + "- Flags: {:04x}\n".format(self._flags) + \
 			self._TAB * indent + "- Entry Count: {}\n".format(self._entry_count) + \
 			self._TAB * indent + "- Identifier: {}".format(self._identifier)
@@ -376,18 +466,20 @@ class CatalogDirectoryRecord(CatalogRecord):
 	def get_type(cls):
 		return 1
 
+_CATALOG_FILE_RECORD = struct.Struct(">HBB16sIHIIHIIIII16sH12s12sI")
+
 class CatalogFileRecord(CatalogRecord):
 	def __init__(self, key, data):
-		self._name = key._name
+		self._key = key
 		_type, self._flags, self._file_type, self._file_information, self._identifier, \
 			self._data_fork_number, self._data_fork_size, self._data_fork_allocated_size, self._resource_fork_number, self._resource_fork_size, self._resource_fork_allocated_size, \
 			creation_timestamp, modification_timestamp, backup_timestamp, \
 			self._extended_file_information, self._clump_size, self._data_fork_extents_records, self._resource_fork_extents_records, unused = \
-			struct.unpack(">HBB16sIHIIHIIIII16sH12s12sI", data[:102])
+			_CATALOG_FILE_RECORD.unpack_from(data, 0)
 
 	@property
 	def name(self):
-		return self._name
+		return self._key.name
 		
 	@property
 	def data_size(self):
@@ -405,21 +497,9 @@ class CatalogFileRecord(CatalogRecord):
 	def resource_extents_records(self):
 		return self._resource_fork_extents_records
 		
-	@classmethod
-	def _get_extents_content(cls, extents, size):
-		data = extents.read_blocks(0, extents.size)
-		return data[:size]
-	
-	def get_content(self, stream=0):
-		if stream == 0:
-			return self._get_extents_content(self._data_fork_extents_records, self._data_fork_size)
-		elif stream == 1:
-			return self._get_extents_content(self._resource_fork_extents_records, self._resource_fork_size)		
-		raise ValueError("unknown stream")
-		
 	def dump(self, indent=0):
 		return self._TAB * indent + "AppleCatalogFileRecord:\n" + \
-			self._TAB * indent + "- Name: {}\n".format(repr(self._name)) + \
+			self._TAB * indent + "- Name: {}\n".format(repr(self.name)) + \
 			self._TAB * indent + "- Flags: {:04x}\n".format(self._flags) + \
 			self._TAB * indent + "- File Type: {}\n".format(self._file_type) + \
 			self._TAB * indent + "- Identifier: {}\n".format(self._identifier) + \
@@ -437,16 +517,18 @@ class CatalogFileRecord(CatalogRecord):
 	def get_type(cls):
 		return 2
 
+_CATALOG_THREAD_RECORD = struct.Struct(">H8sIB")
+
 class CatalogThreadRecord(common.Dumpeable):
 	def __init__(self, key, data):
-		_type, unused, self._parent_identifier, name_size = struct.unpack(">H8sIB", data[:15])
+		_type, unused, self._parent_identifier, name_size = _CATALOG_THREAD_RECORD.unpack_from(data, 0)
 		
-		self._name = data[15:15 + name_size].decode("ascii")
+		self._raw_name = data[15:15 + name_size]
 			
 	def dump(self, indent=0):
 		return self._TAB * indent + "{}:\n".format(self.__class__.__name__) + \
 			self._TAB * indent + "- Parent Identifier: {}\n".format(self._parent_identifier) + \
-			self._TAB * indent + "- Name: {}".format(self._name)
+			self._TAB * indent + "- Name: {}".format(_to_string(self._raw_name))
 
 class CatalogDirectoryThreadRecord(CatalogThreadRecord, CatalogRecord):
 	@classmethod
@@ -458,74 +540,53 @@ class CatalogFileThreadRecord(CatalogThreadRecord, CatalogRecord):
 	def get_type(cls):
 		return 4
 		
-class CatalogSearchKeyByParentIdentifier(object):
-	def __init__(self, parent_identifier):
-		self._parent_identifier = parent_identifier
-		
-	def __gt__(self, other):
-		if not isinstance(other, CatalogKey):
-			raise ValueError("can't compare against {}".format(other.__class__.__name__))
-		return self._parent_identifier > other._parent_identifier
-		
-	def __eq__(self, other):
-		if not isinstance(other, CatalogKey):
-			raise ValueError("can't compare against {}".format(other.__class__.__name__))
-		return self._parent_identifier == other._parent_identifier
-		
+# catalog record classes by type, from_key_data looks them up here
+_CATALOG_RECORDS = {c.get_type(): c for c in reversed(CatalogRecord.__subclasses__())}
+
 class BTree(common.Dumpeable):
 	def __init__(self, extents, file):
-		# get the node size from the header node first
-		data = extents.read_blocks(0, 1)
-		node_size = struct.unpack(">H", data[32:34])[0]
-		block_size = len(data)
-		
-		self._header_node = self._read_node(0, node_size, extents, block_size, file)
-		
-		self._nodes = [self._header_node, ]
-		self._records = {}
-		for index in range(1, self._header_node.node_count):
-			if self._header_node.is_used(index):
-				node = self._read_node(index, node_size, extents, block_size, file)
-			else:
-				node = None
-								
-			self._nodes.append(node)
-	
-	@classmethod
-	def _read_node(cls, index, node_size, extents, block_size, file):
-		if block_size >= node_size:
-			block_index = index * node_size // block_size
-			block_offset = (index * node_size) % block_size
-			block = extents.read_blocks(block_index, 1)
-			data = block[block_offset:block_offset + node_size]
-		else:
-			node_blocks = node_size // block_size
-			block_index = index * node_blocks
-			data = extents.read_blocks(block_index, node_blocks)
-		return BTreeNode.from_sector(data, file)
+		# the whole file is read at once and the nodes are sliced from it, the node size
+		# comes from the header node
+		data = extents.read_all_blocks()
+		node_size = _UINT16.unpack_from(data, 32)[0]
+		
+		# nodes are parsed from views of the file data, without copying them
+		self._data = memoryview(data)
+		self._node_size = node_size
+		self._file = file
+		self._header_node = BTreeNode.from_sector(self._data[:node_size], file)
+		
+		# nodes are parsed the first time they are used
+		self._nodes = {0: self._header_node}
+		
+	def _get_node(self, index):
+		node = self._nodes.get(index)
+		if node == None:
+			node = BTreeNode.from_sector(self._data[index * self._node_size:(index + 1) * self._node_size], self._file)
+			self._nodes[index] = node
+		return node
 	
-	def search(self, key):
-		current_node = self._nodes[self._header_node.root_node]
-		while isinstance(current_node, BTreeIndexNode):
-			try:
-				current_node = self._nodes[current_node.search(key)]
-			except KeyError as e:
-				return []
-
-		result = []
-		while True:
-			try:
-				node_records = current_node.search(key)
-				result.extend(node_records)
-				if current_node.next_node == 0:
-					return result
-			except KeyError as e:
-				return result
-			current_node = self._nodes[current_node.next_node]
+	def iter_entries(self):
+		# leaf nodes are chained in key order, yields the keys along with the record data
+		index = self._header_node.first_leaf
+		while index != 0:
+			node = self._get_node(index)
+			yield from node.entries
+			index = node.next_node
+				
+	def dump_iter(self, indent=0):
+		yield self._TAB * indent + "- AppleBTree:\n"
+		separator = ""
+		for index in range(self._header_node.node_count):
+			if index == 0 or self._header_node.is_used(index):
+				yield separator
+				yield from self._get_node(index).dump_iter(indent + 1)
+				separator = "\n"
 				
 	def dump(self, indent=0):
-		return self._TAB * indent + "- AppleBTree:\n" + \
-			"\n".join([node.dump(indent + 1) for node in self._nodes if node is not None])
+		return "".join(self.dump_iter(indent))
+
+_BTREE_NODE_DESCRIPTOR = struct.Struct(">IIBBHH")
 
 class BTreeNode(common.Dumpeable):
 	def __init__(self, next, previous, level, record_offsets, data, file):
@@ -556,24 +617,26 @@ class BTreeNode(common.Dumpeable):
 	@classmethod
 	def from_sector(cls, data, file):
 		node_size = len(data)
-		next, previous, _type, level, record_count, unused = struct.unpack(">IIBBHH", data[:14])
+		next, previous, _type, level, record_count, unused = _BTREE_NODE_DESCRIPTOR.unpack_from(data, 0)
 		
-		record_offsets = []
-		for index in range(record_count):
-			record_offsets.append(struct.unpack(">H", data[node_size - (index + 1) * 2:node_size - index * 2])[0])
+		# the record offsets are stored backwards at the end of the node
+		record_offsets = [offset for offset, in _UINT16.iter_unpack(memoryview(data)[node_size - record_count * 2:node_size])]
+		record_offsets.reverse()
 			
-		for c in cls.__subclasses__():
-			if c.get_type() == _type:
-				return c(next, previous, level, record_offsets, data, file)
+		c = _BTREE_NODES.get(_type)
+		if c != None:
+			return c(next, previous, level, record_offsets, data, file)
 				
 		raise ValueError("unknown node type ({})".format(_type))
 				
+_BTREE_HEADER_RECORD = struct.Struct(">HIIIIHHII")
+
 class BTreeHeaderNode(BTreeNode):
 	def __init__(self, next, previous, level, record_offsets, data, file):
 		super().__init__(next, previous, level, record_offsets, data, file)
 		
 		self._tree_depth, self._root_node, self._data_records, self._first_leaf, self._last_leaf, self._node_size, self._max_key_size, self._node_count, self._free_nodes = \
-			struct.unpack(">HIIIIHHII", data[self._record_offsets[0]:self._record_offsets[0] + 30])
+			_BTREE_HEADER_RECORD.unpack_from(data, self._record_offsets[0])
 			
 		self._used = data[self._record_offsets[2]:self._record_offsets[2] + self._node_size - 256]
 
@@ -585,8 +648,17 @@ class BTreeHeaderNode(BTreeNode):
 	def root_node(self):
 		return self._root_node
 		
+	@property
+	def first_leaf(self):
+		return self._first_leaf
+		
+	@functools.cached_property
+	def _used_nodes(self):
+		# bitmap of used nodes (msb first) as a set of node indexes, only dump checks them
+		return frozenset([index * 8 + bit for index, byte in enumerate(self._used) if byte != 0 for bit in range(8) if byte & (0x80 >> bit)])
+		
 	def is_used(self, index):
-		return self._used[index // 8] & (1 << (7 - (index % 8))) != 0
+		return index in self._used_nodes
 	
 	def dump(self, indent=0):
 		return super().dump(indent) + "\n" + \
@@ -608,33 +680,28 @@ class BTreeIndexNode(BTreeNode):
 	def __init__(self, next, previous, level, record_offsets, data, file):
 		super().__init__(next, previous, level, record_offsets, data, file)
 		
-		self._childs = []
+		build_key = file.build_key
+		unpack_from = _UINT32.unpack_from
+		childs = []
 		for index in self._record_offsets:
 			key_size = data[index]
 			if key_size > 0:
-				key_size += 1
-				if key_size & 0x01:
-					key_size += 1
-				key = file.build_key(data[index:index + key_size])
-				number = struct.unpack(">I", data[index + key_size:index + key_size + 4])[0]
-				self._childs.append((key, number))
+				# key length byte plus the key, padded to an even size
+				key_size = (key_size + 2) & ~0x01
+				childs.append((build_key(data[index:index + key_size]), unpack_from(data, index + key_size)[0]))
+		self._childs = childs
 					
-	def search(self, key):
-		# fail if the key is before the first child
-		if not (key > self._childs[0][0] or key == self._childs[0][0]):
-			raise KeyError
-		result = self._childs[0][1]
-		for child_key, child_index in self._childs[1:]:
-			if key > child_key:
-				result = child_index
-			else:
-				break
-		return result
-		
+	def dump_iter(self, indent=0):
+		yield super().dump(indent) + "\n" + \
+			self._TAB * indent + "- Childs:\n"
+		tab = self._TAB * (indent + 1)
+		separator = ""
+		for key, number in self._childs:
+			yield separator + key.dump(indent + 1) + "\n" + tab + "- Pointer: {}".format(number)
+			separator = "\n"
+	
 	def dump(self, indent=0):
-		return super().dump(indent) + "\n" + \
-			self._TAB * indent + "- Childs:\n" + \
-			"\n".join([key.dump(indent + 1) + "\n" + self._TAB * (indent + 1) + "- Pointer: {}".format(number) for key, number in self._childs])
+		return "".join(self.dump_iter(indent))
 	
 	@classmethod
 	def get_type(cls):
@@ -644,40 +711,47 @@ class BTreeLeafNode(BTreeNode):
 	def __init__(self, next, previous, level, record_offsets, data, file):
 		super().__init__(next, previous, level, record_offsets, data, file)
 
-		self._records = []
+		# only the keys are parsed here, the records are built when they are needed
+		build_key = file.build_key
+		entries = []
 		for index in self._record_offsets:
 			key_size = data[index]
 			if key_size > 0:
-				key_size += 1
-				if key_size & 0x01:
-					key_size += 1
-				key = file.build_key(data[index:index + key_size])
-				record = file.build_record(key, data[index + key_size:])
-				self._records.append((key, record))
-
-	def search(self, key):
-		# fail if the key is before the first child
-		if not (key > self._records[0][0] or key == self._records[0][0]):
-			raise KeyError
-		result = []
-		for current_key, current_record in self._records:
-			if key > current_key:
-				continue
-			elif key == current_key:
-				result.append(current_record)
-			else:
-				return result
-		return result
+				# key length byte plus the key, padded to an even size
+				key_size = (key_size + 2) & ~0x01
+				entries.append((build_key(data[index:index + key_size]), data[index + key_size:]))
+		self._entries = entries
+		self._file = file
+		self._records = None
+		
+	@property
+	def entries(self):
+		return self._entries
+		
+	def _get_records(self):
+		if self._records == None:
+			build_record = self._file.build_record
+			self._records = [(key, build_record(key, data)) for key, data in self._entries]
+		return self._records
+
+	def dump_iter(self, indent=0):
+		yield super().dump(indent) + "\n" + \
+			self._TAB * indent + "- Records:\n"
+		separator = ""
+		for key, record in self._get_records():
+			yield separator + key.dump(indent + 1) + "\n" + record.dump(indent + 1)
+			separator = "\n"
 	
 	def dump(self, indent=0):
-		return super().dump(indent) + "\n" + \
-			self._TAB * indent + "- Records:\n" + \
-			"\n".join([key.dump(indent + 1) + "\n" + record.dump(indent + 1) for key, record in self._records])
+		return "".join(self.dump_iter(indent))
 			
 	@classmethod
 	def get_type(cls):
 		return 255
 		
+# node classes by type, from_sector looks them up here
+_BTREE_NODES = {c.get_type(): c for c in reversed(BTreeNode.__subclasses__())}
+
 class File(common.File, common.Dumpeable):
 	def __init__(self, record, catalog):
 		self._record = record
@@ -721,13 +795,14 @@ class Directory(common.Directory, common.Dumpeable):
 	def name(self):
 		return self._record.name
 
-	@property
+	# the childs are looked up once, the tree walks read them more than once
+	@functools.cached_property
 	def directories(self):
-		return tuple(map(lambda record: Directory(record, self._catalog), self._catalog.get_directories(self._record.identifier)))
+		return tuple([Directory(record, self._catalog) for record in self._catalog.get_directories(self._record.identifier)])
 		
-	@property
+	@functools.cached_property
 	def files(self):
-		return tuple(map(lambda record: File(record, self._catalog), self._catalog.get_files(self._record.identifier)))
+		return tuple([File(record, self._catalog) for record in self._catalog.get_files(self._record.identifier)])
 		
 	def dump(self, indent=0):
 		return self._record.dump(indent)
\ No newline at end of file
@@ -26,57 +26,98 @@
 # OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import functools
+import operator
+import struct
+
 # Based on:
 # https://github.com/claunia/edccchk/blob/master/edccchk.c
 # See also:
 # https://gist.github.com/murachue/b52ded0b7968e870b6a310d439ddcb30
 # https://psx-spx.consoledev.net/cdromdrive/#cdrom-sector-encoding
 
+# tables are constants, they are built once (the first time they are needed, as the edc ones
+# take a while and only raw images use them) and shared by all the instances
+
+@functools.lru_cache(maxsize=None)
+def _get_edc_tables():
+	table = [0 for i in range(256)]
+	for i in range(256):
+		edc = i
+		for j in range(8):
+			edc = (edc >> 1) ^ (0xD8018001 if edc & 1 else 0)		
+		table[i] = edc
+	
+	# tables to process 16 bits at once (slicing by 4 bytes, merged in pairs):
+	# table n gives the edc of a byte followed by n zero bytes
+	tables = [table]
+	for n in range(3):
+		tables.append([(edc >> 8) ^ table[edc & 0xff] for edc in tables[-1]])
+	low_table = [tables[3][i & 0xff] ^ tables[2][i >> 8] for i in range(65536)]
+	high_table = [tables[1][i & 0xff] ^ tables[0][i >> 8] for i in range(65536)]
+	return table, low_table, high_table
+
+@functools.lru_cache(maxsize=None)
+def _get_edc_words(count):
+	return struct.Struct("<{}I".format(count))
+
+@functools.lru_cache(maxsize=None)
+def _get_ecc_tables():
+	f_table = bytearray(256)
+	b_table = bytearray(256)
+	for i in range(256):
+		# multiply by alpha, the polynomial is masked in when the high bit is set
+		j = ((i << 1) ^ (-(i >> 7) & 0x11d)) & 0xff
+		f_table[i] = j
+		b_table[i ^ j] = i
+	# as bytes, to be used as bytes.translate() maps over many bytes at once
+	return bytes(f_table), bytes(b_table)
+
+@functools.lru_cache(maxsize=None)
+def _get_ecc_gather(major_count, minor_count, major_mult, minor_inc):
+	# the positions visited for each major only depend on the parameters, they are
+	# gathered so row n holds the n-th byte visited by every major
+	size = major_count * minor_count
+	return operator.itemgetter(*[((major >> 1) * major_mult + (major & 1) + minor * minor_inc) % size \
+		for minor in range(minor_count) for major in range(major_count)])
+
 class EDC(object):
 	def __init__(self):
-		self.__table = [0 for i in range(256)]
-		for i in range(256):
-			edc = i
-			for j in range(8):
-				edc = (edc >> 1) ^ (0xD8018001 if edc & 1 else 0)		
-			self.__table[i] = edc
+		self.__table, self.__low_table, self.__high_table = _get_edc_tables()
 			
 	def compute(self, data):
+		count = len(data) // 4
+		low_table = self.__low_table
+		high_table = self.__high_table
 		edc = 0
-		for b in data:
+		for word in _get_edc_words(count).unpack_from(data):
+			word ^= edc
+			edc = low_table[word & 0xffff] ^ high_table[word >> 16]
+		for b in data[count * 4:]:
 			edc = (edc >> 8) ^ self.__table[(edc ^ b) & 0xff]
 		return edc
 		
 class ECC(object):
 	def __init__(self):
-		self._f_table = [0 for i in range(256)]
-		self._b_table = [0 for i in range(256)]
-		for i in range(256):
-			j = (i << 1) ^ (0x11d if i & 0x80 else 0)
-			self._f_table[i] = j
-			self._b_table[i ^ j] = i
+		self._f_map, self._b_map = _get_ecc_tables()
 			
-	def _compute_pq(self, data, major_count, minor_count, major_mult, minor_inc):
-		result = bytearray(b"\x00" * major_count * 2)
-		size = major_count * minor_count
-		for major in range(major_count):
-			index = (major >> 1) * major_mult + (major & 1)
-			ecc_a = 0
-			ecc_b = 0
-			for minor in range(minor_count):
-				temp = data[index]
-				index += minor_inc
-				if index >= size:
-					index -= size
-				ecc_a ^= temp
-				ecc_b ^= temp
-				ecc_a = self._f_table[ecc_a]
-			ecc_a = self._b_table[self._f_table[ecc_a] ^ ecc_b]
-			result[major] = ecc_a
-			result[major + major_count] = ecc_a ^ ecc_b
-		return result
+	def _compute_parity(self, rows, major_count, minor_count):
+		# all the majors are computed at once, each one is a byte of a row wide integer
+		# (xor) and the multiplications are done with translate(); row n holds the n-th
+		# byte visited by every major
+		f_map = self._f_map
+		ecc_a = 0
+		ecc_b = 0
+		for offset in range(0, major_count * minor_count, major_count):
+			row = int.from_bytes(rows[offset:offset + major_count], "big")
+			ecc_b ^= row
+			ecc_a = int.from_bytes((ecc_a ^ row).to_bytes(major_count, "big").translate(f_map), "big")
+		ecc_a = int.from_bytes(ecc_a.to_bytes(major_count, "big").translate(f_map), "big") ^ ecc_b
+		ecc_a = ecc_a.to_bytes(major_count, "big").translate(self._b_map)
+		return ecc_a + (int.from_bytes(ecc_a, "big") ^ ecc_b).to_bytes(major_count, "big")
 
 	def compute(self, data):
-		p_parity = self._compute_pq(data, 86, 24, 2, 86)
-		q_parity = self._compute_pq(data + p_parity, 52, 43, 86, 88)
+		# the p majors visit consecutive bytes, so the data is already laid out in rows
+		p_parity = self._compute_parity(data, 86, 24)
+		q_parity = self._compute_parity(bytes(_get_ecc_gather(52, 43, 86, 88)(b"".join((data, p_parity)))), 52, 43)
 		return p_parity + q_parity
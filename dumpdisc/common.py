@@ -26,40 +26,26 @@
 # OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-import struct
+import collections
+import itertools
 
-def _unpack(format, data):
-	result = ()
-	while len(format) > 0:
-		if format[0] in (">", "<"):
-			current_format = format[0]
-			format = format[1:]
-		else:
-			current_format = ""
-		while len(format) > 0 and not format[0] in (">", "<"):
-			current_format = current_format + format[0]
-			format = format[1:]
-		
-		current_size = struct.calcsize(current_format)
-		current_data = data[:current_size]
-		data = data[current_size:]
-		result = result + struct.unpack(current_format, current_data)
-		
-	if len(data) != 0:
-		raise ValueError("remaining data to unpack")
-		
-	return result
-	
 class Dumpeable(object):
 	_TAB = "    "
 
 	def dump(self, indent=0):
 		raise NotImplementedError
 		
+	def dump_iter(self, indent=0):
+		yield self.dump(indent)
+		
 	def __str__(self):
 		return self.dump()
 
 class FileSystem(object):
+	@classmethod
+	def probe(cls, image, base_offset=0):
+		raise NotImplementedError
+		
 	@property
 	def partitions(self):
 		raise NotImplementedError
@@ -78,6 +64,8 @@ class Partition(object):
 		raise NotImplementedError
 
 class File(Dumpeable):
+	IS_DIR = False
+	
 	@property
 	def name(self):
 		raise NotImplementedError
@@ -88,8 +76,13 @@ class File(Dumpeable):
 	
 	def get_content(self, stream=0):
 		raise NotImplementedError
+	
+	def iter_content(self, stream=0):
+		yield self.get_content(stream)
 		
 class Directory(Dumpeable):
+	IS_DIR = True
+	
 	@property
 	def name(self):
 		raise NotImplementedError
@@ -101,3 +94,13 @@ class Directory(Dumpeable):
 	@property
 	def files(self):
 		raise NotImplementedError
+
+def walk(directory, depth=1):
+	# yields every entry below the directory with its depth, depth first and the
+	# directories of each level before its files
+	pending = collections.deque([(entry, depth) for entry in directory.directories + directory.files])
+	while len(pending) > 0:
+		entry, depth = pending.popleft()
+		yield entry, depth
+		if entry.IS_DIR:
+			pending.extendleft([(e, depth + 1) for e in itertools.chain(reversed(entry.files), reversed(entry.directories))])
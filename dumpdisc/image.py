@@ -26,10 +26,24 @@
 # OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import bisect
+import collections
+import mmap
 import os
+import stat
 import struct
+import threading
 from . import cdrom
 
+def _will_need(fd, offset, length):
+	# hint the kernel about data that is going to be read soon, it is just an
+	# optimization so it is silently skipped when not supported
+	try:
+		if fd != None and hasattr(os, "posix_fadvise"):
+			os.posix_fadvise(fd, offset, length, os.POSIX_FADV_WILLNEED)
+	except (OSError, ValueError):
+		pass
+
 class Image(object):
 	def read_blocks(self, address=None, count=1):
 		raise NotImplementedError
@@ -40,6 +54,14 @@ class Image(object):
 	def read_blocks_raw(self, address=None, count=1):
 		raise NotImplementedError
 	
+	def read_blocks_data_into(self, address, count, data):
+		block = self.read_blocks_data(address, count)
+		data[:len(block)] = block
+		return len(block)
+	
+	def prefetch(self, address, count=1):
+		pass
+	
 	@property
 	def current_block(self):
 		raise NotImplementedError
@@ -57,28 +79,90 @@ class Image(object):
 	def __exit__(self, type, value, traceback):
 		self.close()
 		
+def _get_file_size(f):
+	# regular files are sized with fstat, leaving the position untouched; anything
+	# else (devices, in memory files) is sized seeking to the end and back
+	try:
+		st = os.fstat(f.fileno())
+		if stat.S_ISREG(st.st_mode):
+			return st.st_size
+	except (AttributeError, OSError):
+		pass
+	position = f.tell()
+	size = f.seek(0, os.SEEK_END)
+	f.seek(position)
+	return size
+
 class ISOImage(Image):
 	def __init__(self, f, block_size=2048):
 		self._block_size = block_size
 		self._f = f
 		
-		self._f.seek(0, os.SEEK_END)
-		self._sectors = self.current_block
-		
+		self._sectors = _get_file_size(self._f) // self.block_size
+		self._current_block = 0
+		
+		# use positional reads when backed by a real file descriptor, so every
+		# request is a single syscall instead of a seek followed by a read
+		try:
+			self._fd = self._f.fileno()
+		except (AttributeError, OSError):
+			self._fd = None
+		if not hasattr(os, "pread"):
+			self._fd = None
+		
+		# map the image when possible so blocks are copied straight from the page cache,
+		# falling back to positional reads where it can't be mapped (e.g. 32 bit hosts)
+		self._map = None
+		if self._fd != None and self._sectors > 0:
+			try:
+				self._map = mmap.mmap(self._fd, 0, access=mmap.ACCESS_READ)
+			except (OSError, ValueError, OverflowError):
+				self._map = None
+	
 	def read_blocks(self, address=None, count=1):
 		if address != None:
-			self._f.seek(address * self.block_size)
-		return self._f.read(count * self.block_size)
-		
+			self._current_block = address
+		if self._map != None:
+			start = self._current_block * self.block_size
+			data = self._map[start:start + count * self.block_size]
+		elif self._fd != None:
+			data = os.pread(self._fd, count * self.block_size, self._current_block * self.block_size)
+		else:
+			self._f.seek(self._current_block * self.block_size)
+			data = self._f.read(count * self.block_size)
+		self._current_block += len(data) // self.block_size
+		return data
+	
 	def read_blocks_data(self, address=None, count=1):
 		return self.read_blocks(address, count)
 	
 	def read_blocks_raw(self, address=None, count=1):
 		raise NotImplementedError
-		
+	
+	def read_blocks_data_into(self, address, count, data):
+		if self._map == None and (self._fd == None or not hasattr(os, "preadv")):
+			return super().read_blocks_data_into(address, count, data)
+		# read straight into the caller buffer
+		if address != None:
+			self._current_block = address
+		start = self._current_block * self.block_size
+		if self._map != None:
+			# the view is released right away, a mapping can't be closed while exported
+			with memoryview(self._map) as view:
+				with view[start:start + count * self.block_size] as block:
+					size = len(block)
+					data[:size] = block
+		else:
+			size = os.preadv(self._fd, [memoryview(data)[:count * self.block_size]], start)
+		self._current_block += size // self.block_size
+		return size
+	
+	def prefetch(self, address, count=1):
+		_will_need(self._fd, address * self.block_size, count * self.block_size)
+	
 	@property
 	def current_block(self):
-		return self._f.tell() // self.block_size
+		return self._current_block
 	
 	@property
 	def block_size(self):
@@ -89,85 +173,155 @@ class ISOImage(Image):
 		return self._sectors
 		
 	def close(self):
+		if self._map != None:
+			self._map.close()
 		self._f.close()		
 		
 
+_SYNC = b'\x00\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\x00'
+_ZERO_DATA = bytes(2048)
+_EDC = struct.Struct("<I")
+
+def _verify_raw_sectors(name, address, count):
+	with open(name, "rb") as f:
+		return RawCDImage(f).verify(address, count)
+
 # See:
 # https://github.com/libyal/libodraw/blob/main/documentation/Optical%20disc%20RAW%20format.asciidoc
 # https://psx-spx.consoledev.net/cdromdrive/#cdrom-sector-encoding
 class RawCDImage(Image):
 	RAW_SECTOR_SIZE = 2352
 	DATA_SECTOR_SIZE = 2048
+	VERIFY_SECTOR_COUNT = 4096
 
 	def __init__(self, f):
 		self._offset = 0
 		self._current_sector = 0
 		self._f = f
 		
-		self._f.seek(0, os.SEEK_END)
-		self._sectors = self._f.tell() // self.RAW_SECTOR_SIZE
+		self._sectors = _get_file_size(self._f) // self.RAW_SECTOR_SIZE
+		
+		# the descriptor is only used to hint the kernel about upcoming reads
+		try:
+			self._fd = self._f.fileno()
+		except (AttributeError, OSError):
+			self._fd = None
 		
 		self._ecc = cdrom.ECC()
 		self._edc = cdrom.EDC()
 		
-	def _read_raw_sector(self, address=None):
+		# single sectors are read into the same buffer, sectors are split with views
+		self._sector = bytearray(self.RAW_SECTOR_SIZE)
+		
+	def _read_raw_sectors(self, address, count):
+		# all the sectors are read at once, the returned view is only valid until the next read
 		if address != None:
 			self._current_sector = address
 			self._f.seek(address * self.RAW_SECTOR_SIZE)
-		data = self._f.read(self.RAW_SECTOR_SIZE)
-		if len(data) != self.RAW_SECTOR_SIZE:
+		size = count * self.RAW_SECTOR_SIZE
+		buffer = self._sector if count == 1 else bytearray(size)
+		if self._f.readinto(buffer) != size:
 			raise IOError("can't read entire sector")
-		self._current_sector += 1
-		return data
+		self._current_sector += count
+		return memoryview(buffer)
 	
-	def _read_sector(self, strict_size=False, address=None):
-		sector = self._read_raw_sector(address)
-		
-		sync, offset, mode, data = struct.unpack("12s3sB2336s", sector)
-		if sync != b'\x00\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\x00':
+	def _read_sector(self, sector, number, strict_size=False):
+		sync, offset, mode, data = sector[:12], sector[12:15], sector[15], sector[16:]
+		if sync != _SYNC:
 			raise IOError("sync for sector invalid")
 		if mode == 0:
-			data = b'\x00' * self.DATA_SECTOR_SIZE
+			data = _ZERO_DATA
 		elif mode == 1:
-			data, edc, reserved, ecc = struct.unpack("2048sI8s276s", data)
-			if edc != self._edc.compute(sync + offset + mode + data):
-				raise IOError("edc invalid for sector {}".format(self._current_sector - 1))
-			if ecc != self._ecc.compute(offset + mode + data + struct.pack("<I", edc)):
-				raise IOError("ecc invalid for sector {}".format(self._current_sector - 1))				
+			# the edc covers sync, header and data, the ecc covers header, data, edc and
+			# the reserved bytes: both are checked over the sector itself
+			edc, = _EDC.unpack_from(sector, 2064)
+			if edc != self._edc.compute(sector[:2064]):
+				raise IOError("edc invalid for sector {}".format(number))
+			if sector[2076:] != self._ecc.compute(sector[12:2076]):
+				raise IOError("ecc invalid for sector {}".format(number))
+			data = sector[16:2064]
 		elif mode == 2:
-			subheader, data = struct.unpack("8s2328s", data)
+			subheader = sector[16:24]
 			if subheader[2] != subheader[6]:
-				raise IOError("submode flags do not match for sector {} ({} {})".format(self._current_sector - 1, subheader[2], subheader[6]))
-			if subheader[2] & 0x20 == 0:
-				data, edc, ecc = struct.unpack("2048sI276s", data)
-				if ecc != self._ecc.compute(b"\x00" * 4 + subheader + data + struct.pack("<I", edc)):
-					raise IOError("ecc invalid for sector {}".format(self._current_sector - 1))
-			else:
-				data, edc = struct.unpack("2324sI", data)
-			if edc != self._edc.compute(subheader + data):
-				raise IOError("edc invalid for sector {}".format(self._current_sector - 1))
+				raise IOError("submode flags do not match for sector {} ({} {})".format(number, subheader[2], subheader[6]))
+			# form 1: 2048 bytes of data, edc and ecc; form 2: 2324 bytes of data and edc
+			end = 2072 if subheader[2] & 0x20 == 0 else 2348
+			edc, = _EDC.unpack_from(sector, end)
+			if end == 2072:
+				if sector[2076:] != self._ecc.compute(b"\x00" * 4 + sector[16:2076]):
+					raise IOError("ecc invalid for sector {}".format(number))
+			if edc != self._edc.compute(sector[16:end]):
+				raise IOError("edc invalid for sector {}".format(number))
+			data = sector[24:end]
 			if strict_size and len(data) != self.DATA_SECTOR_SIZE:
 				raise IOError("mode 2 form 1 sector found")
 		else:
-			raise IOError("invalid mode for sector {} ({})".format(self._current_sector - 1, mode))
+			raise IOError("invalid mode for sector {} ({})".format(number, mode))
 		
 		return data
 		
+	def _read_sector_strict(self, sector, number):
+		return self._read_sector(sector, number, True)
+	
+	def _read_raw_sector(self, sector, number):
+		return sector
+		
 	def _read_blocks(self, read_sector, address, count):
-		data = read_sector(address)
-		for i in range(count - 1):
-			data += read_sector()
-		return data
+		# one read for all the sectors, then the data of each one is copied once into the result
+		first = address if address != None else self._current_sector
+		sectors = self._read_raw_sectors(address, count)
+		return b"".join([read_sector(sectors[index * self.RAW_SECTOR_SIZE:(index + 1) * self.RAW_SECTOR_SIZE], first + index) for index in range(count)])
+
+	def verify(self, address=0, count=None):
+		# checks the sectors, returns the number and error of the invalid ones
+		if count == None:
+			count = self._sectors - address
+		errors = []
+		for first in range(address, address + count, self.VERIFY_SECTOR_COUNT):
+			sector_count = min(self.VERIFY_SECTOR_COUNT, address + count - first)
+			sectors = self._read_raw_sectors(first, sector_count)
+			for index in range(sector_count):
+				try:
+					self._read_sector(sectors[index * self.RAW_SECTOR_SIZE:(index + 1) * self.RAW_SECTOR_SIZE], first + index)
+				except IOError as e:
+					errors.append((first + index, str(e)))
+		return errors
+		
+	def verify_all(self, workers=None):
+		# sectors are independent, so chunks of them are checked in parallel by processes that
+		# open the image again (only possible when the image is backed by a named file)
+		name = getattr(self._f, "name", None)
+		if not isinstance(name, str) or workers == 1:
+			return self.verify()
+		import concurrent.futures
+		with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+			futures = [executor.submit(_verify_raw_sectors, name, first, min(self.VERIFY_SECTOR_COUNT, self._sectors - first)) \
+				for first in range(0, self._sectors, self.VERIFY_SECTOR_COUNT)]
+			return [error for future in futures for error in future.result()]
 
 	def read_blocks(self, address=None, count=1):
-		return self._read_blocks(lambda a=None: self._read_sector(True, a), address, count)
+		return self._read_blocks(self._read_sector_strict, address, count)
 		
 	def read_blocks_data(self, address=None, count=1):
-		return self._read_blocks(lambda a=None: self._read_sector(False, a), address, count)
+		return self._read_blocks(self._read_sector, address, count)
+	
+	def read_blocks_data_into(self, address, count, data):
+		# the data of each sector (a view into the sectors read) is copied straight into the caller buffer
+		first = address if address != None else self._current_sector
+		sectors = self._read_raw_sectors(address, count)
+		size = 0
+		for index in range(count):
+			block = self._read_sector(sectors[index * self.RAW_SECTOR_SIZE:(index + 1) * self.RAW_SECTOR_SIZE], first + index)
+			data[size:size + len(block)] = block
+			size += len(block)
+		return size
 	
 	def read_blocks_raw(self, address=None, count=1):
-		return self._read_blocks(lambda a=None: self._read_raw_sector(a), address, count)
+		return self._read_blocks(self._read_raw_sector, address, count)
 		
+	def prefetch(self, address, count=1):
+		_will_need(self._fd, address * self.RAW_SECTOR_SIZE, count * self.RAW_SECTOR_SIZE)
+	
 	@property
 	def current_block(self):
 		return self._current_sector
@@ -218,44 +372,42 @@ class DDRescueImage(Image):
 		self._image = image
 
 		with open(map_filename, "r") as mf:
-			lines = mf.readlines()
-
-			index = 0
-			while index < len(lines):
-				line = lines[index]
-				index += 1
-				if line.strip()[0] != '#':
-					current_pos, status, current_pass = line.strip().split()
-					break
-
-			current_pos = _parse_c_number(current_pos)
+			rows = [line.split() for line in mf.read().splitlines() if line.strip() != "" and line.strip()[0] != '#']
 
-			if not (status in (self.STATUS_COPYING_NONTRIED_BLOCKS, self.STATUS_TRIMMING_NONTRIED_BLOCKS, self.STATUS_SCRAPING_NONSCRAPED_BLOCKS, self.STATUS_RETRYING_BAD_SECTORS, self.STATUS_FILLING_SPECIFIED_BLOCKS, self.STATUS_GENERATING_APROXIMATE_MAP_FILE, self.STATUS_FINISHED)):
-				raise Exception('unknown status')
+		current_pos, status, current_pass = rows[0]
+		current_pos = _parse_c_number(current_pos)
 
-			current_pass = int(current_pass)
+		if not (status in (self.STATUS_COPYING_NONTRIED_BLOCKS, self.STATUS_TRIMMING_NONTRIED_BLOCKS, self.STATUS_SCRAPING_NONSCRAPED_BLOCKS, self.STATUS_RETRYING_BAD_SECTORS, self.STATUS_FILLING_SPECIFIED_BLOCKS, self.STATUS_GENERATING_APROXIMATE_MAP_FILE, self.STATUS_FINISHED)):
+			raise Exception('unknown status')
 
-			self._bad_areas = []
+		current_pass = int(current_pass)
 
-			while index < len(lines):
-				line = lines[index]
-				index += 1
-				if line.strip()[0] != '#':
-					start, size, status = line.strip().split()
-					start = _parse_c_number(start)
-					size = _parse_c_number(size)
-					if not (status in (self.BLOCK_STATUS_NON_TRIED, self.BLOCK_STATUS_NON_TRIMMED, self.BLOCK_STATUS_NON_SCRAPED, self.BLOCK_STATUS_BAD_SECTORS, self.BLOCK_STATUS_FINISHED)):
-						raise Exception('unknown block status')
+		block_statuses = frozenset((self.BLOCK_STATUS_NON_TRIED, self.BLOCK_STATUS_NON_TRIMMED, self.BLOCK_STATUS_NON_SCRAPED, self.BLOCK_STATUS_BAD_SECTORS, self.BLOCK_STATUS_FINISHED))
+		bad_areas = []
+		for start, size, status in rows[1:]:
+			if not (status in block_statuses):
+				raise Exception('unknown block status')
+			if status != self.BLOCK_STATUS_FINISHED:
+				start = _parse_c_number(start)
+				bad_areas.append((start, start + _parse_c_number(size)))
 
-					if status != self.BLOCK_STATUS_FINISHED:
-						self._bad_areas.append((start, start + size))
+		# sorted and merged, so the area that may overlap a read is found with a binary search
+		bad_areas.sort()
+		merged = []
+		for start, end in bad_areas:
+			if len(merged) > 0 and start <= merged[-1][1]:
+				merged[-1][1] = max(merged[-1][1], end)
+			else:
+				merged.append([start, end])
+		self._bad_starts = tuple(area[0] for area in merged)
+		self._bad_ends = tuple(area[1] for area in merged)
 
 	def read_blocks(self, address=None, count=1):
 		start = (address if address != None else self.current_block) * self.block_size
 		end = start + count * self.block_size
-		for area in self._bad_areas:
-			if (area[0] <= start and start < area[1]) or (area[0] <= end and end < area[1]):
-				raise IOError("bad block (area from {} to {})".format(area[0], area[1]))
+		index = bisect.bisect_right(self._bad_ends, start)
+		if index < len(self._bad_starts) and self._bad_starts[index] < end:
+			raise IOError("bad block (area from {} to {})".format(self._bad_starts[index], self._bad_ends[index]))
 		return self._image.read_blocks(address, count)
 	
 	def read_blocks_data(self, address=None, count=1):
@@ -264,6 +416,9 @@ class DDRescueImage(Image):
 	def read_blocks_raw(self, address=None, count=1):
 		raise NotImplementedError
 	
+	def prefetch(self, address, count=1):
+		self._image.prefetch(address, count)
+	
 	@property
 	def current_block(self):
 		return self._image.current_block
@@ -280,14 +435,15 @@ class ImageWithBadMap(Image):
 		self._image = image
 		
 		with open(bad_map, "r") as mf:
-			self._bad_blocks = set(map(lambda line: int(line.strip()) - bad_map_offset, filter(lambda line: len(line.strip()) > 0, mf.readlines())))
+			bad_blocks = set(map(lambda line: int(line.strip()) - bad_map_offset, filter(lambda line: len(line.strip()) > 0, mf.readlines())))
+		# sorted, so the first bad block of a range is found with a binary search
+		self._bad_blocks = tuple(sorted(bad_blocks))
 
 	def _check_blocks(self, address, count):
 		start = address if address != None else self.current_block
-		end = start + count
-		for offset in range(start, end):
-			if offset in self._bad_blocks:
-				raise IOError("bad block ({})".format(offset))	
+		index = bisect.bisect_left(self._bad_blocks, start)
+		if index < len(self._bad_blocks) and self._bad_blocks[index] < start + count:
+			raise IOError("bad block ({})".format(self._bad_blocks[index]))
 	
 	def read_blocks(self, address=None, count=1):
 		self._check_blocks(address, count)
@@ -296,11 +452,18 @@ class ImageWithBadMap(Image):
 	def read_blocks_data(self, address=None, count=1):
 		self._check_blocks(address, count)
 		return self._image.read_blocks_data(address, count)
+	
+	def read_blocks_data_into(self, address, count, data):
+		self._check_blocks(address, count)
+		return self._image.read_blocks_data_into(address, count, data)
 		
 	def read_blocks_raw(self, address=None, count=1):
 		self._check_blocks(address, count)
 		return self._image.read_blocks_raw(address, count)
 		
+	def prefetch(self, address, count=1):
+		self._image.prefetch(address, count)
+	
 	@property
 	def current_block(self):
 		return self._image.current_block
@@ -332,6 +495,14 @@ class OffsetedImage(Image):
 			address -= self._offset
 		return self._image.read_blocks_raw(address, count)
 		
+	def read_blocks_data_into(self, address, count, data):
+		if address != None:
+			address -= self._offset
+		return self._image.read_blocks_data_into(address, count, data)
+		
+	def prefetch(self, address, count=1):
+		self._image.prefetch(address - self._offset, count)
+	
 	@property
 	def current_block(self):
 		return self._image.current_block + offset
@@ -342,3 +513,88 @@ class OffsetedImage(Image):
 		
 	def close(self):
 		self._image.close()
+
+class CachedImage(Image):
+	def __init__(self, image, capacity=64):
+		self._image = image
+		self._capacity = capacity
+		self._cache = collections.OrderedDict()
+		self._current_block = None
+		# the cache can be shared by threads (e.g. parallel extraction), the reads are done unlocked
+		self._lock = threading.Lock()
+		
+	def _read(self, read, kind, address, count):
+		if address == None:
+			address = self.current_block
+		key = (kind, address, count)
+		with self._lock:
+			data = self._cache.get(key)
+			if data != None:
+				self._cache.move_to_end(key)
+		if data == None:
+			data = read(address, count)
+			with self._lock:
+				self._cache[key] = data
+				if len(self._cache) > self._capacity:
+					self._cache.popitem(last=False)
+		self._current_block = address + count
+		return data
+		
+	def read_blocks(self, address=None, count=1):
+		return self._read(self._image.read_blocks, 0, address, count)
+		
+	def read_blocks_data(self, address=None, count=1):
+		return self._read(self._image.read_blocks_data, 1, address, count)
+		
+	def read_blocks_raw(self, address=None, count=1):
+		return self._read(self._image.read_blocks_raw, 2, address, count)
+		
+	def prefetch(self, address, count=1):
+		self._image.prefetch(address, count)
+	
+	@property
+	def current_block(self):
+		return self._current_block if self._current_block != None else self._image.current_block
+	
+	@property
+	def block_size(self):
+		return self._image.block_size
+		
+	def close(self):
+		self._cache.clear()
+		self._image.close()
+
+class SynchronizedImage(Image):
+	def __init__(self, image):
+		self._image = image
+		self._lock = threading.Lock()
+		
+	def read_blocks(self, address=None, count=1):
+		with self._lock:
+			return self._image.read_blocks(address, count)
+		
+	def read_blocks_data(self, address=None, count=1):
+		with self._lock:
+			return self._image.read_blocks_data(address, count)
+		
+	def read_blocks_raw(self, address=None, count=1):
+		with self._lock:
+			return self._image.read_blocks_raw(address, count)
+		
+	def read_blocks_data_into(self, address, count, data):
+		with self._lock:
+			return self._image.read_blocks_data_into(address, count, data)
+		
+	def prefetch(self, address, count=1):
+		self._image.prefetch(address, count)
+	
+	@property
+	def current_block(self):
+		return self._image.current_block
+	
+	@property
+	def block_size(self):
+		return self._image.block_size
+		
+	def close(self):
+		self._image.close()
@@ -30,57 +30,99 @@
 # https://wiki.osdev.org/ISO_9660
 
 import datetime
+import functools
 import struct
 from . import common
+from .image import CachedImage
 
 
 def _to_string(buffer, encoding):
-	return buffer.rstrip(b"\x00").decode(encoding).strip()
+	if encoding == "utf-16_be":
+		return _to_string_utf16(buffer)
+	# fields are padded with spaces (or zeros), both are removed at once
+	return buffer.rstrip(b"\x00 ").decode(encoding).strip()
+
+def _to_string_utf16(buffer):
+	# the padding is removed once decoded, stripping zero bytes first could cut a
+	# character whose low byte is zero (and fields of odd length end in a lone byte)
+	return buffer[:len(buffer) & ~1].decode("utf-16_be").rstrip("\x00").strip()
+
+# names are looked up on every walk of the tree, so decoded names are kept
+@functools.lru_cache(maxsize=4096)
+def _decode_name(identifier, encoding):
+	if encoding == "utf-16_be":
+		# the version and the padding are removed once decoded, a character byte could be a ";" or a zero
+		identifier = identifier[:len(identifier) & ~1]
+		# most names are plain ascii, their high bytes are all zero and the low ones are the ascii name
+		if identifier[0::2].count(0) == len(identifier) // 2 and identifier[1::2].isascii():
+			identifier = identifier[1::2]
+		else:
+			return identifier.decode(encoding).split(";", 2)[0].rstrip("\x00").strip()
+	name = identifier.split(b";", 2)[0].rstrip(b"\x00")
+	# most names are plain ascii (d-characters), skip the codec for them
+	if name.isascii():
+		return name.decode("ascii").strip()
+	return name.decode(encoding).strip()
+
+_UNSPECIFIED_DATE_TIMES = frozenset((b"0" * 14, b"\x00" * 14))
 
 def _parse_date_time(data):
 	if len(data) != 17:
 		raise ValueError("datetime data size incorrect")
 	
-	return datetime.datetime.strptime(_to_string(data[:14], "ascii"), "%Y%m%d%H%M%S")
-
-def _unpack(format, data):
-	result = ()
-	while len(format) > 0:
-		if format[0] in (">", "<"):
-			current_format = format[0]
-			format = format[1:]
-		else:
-			current_format = ""
-		while len(format) > 0 and not format[0] in (">", "<"):
-			current_format = current_format + format[0]
-			format = format[1:]
-		
-		current_size = struct.calcsize(current_format)
-		current_data = data[:current_size]
-		data = data[current_size:]
-		result = result + struct.unpack(current_format, current_data)
-		
-	if len(data) != 0:
-		raise ValueError("remaining data to unpack")
-		
-	return result
+	# the digits are at fixed positions, an unspecified date is all zeros (as digits or bytes)
+	digits = data[:14]
+	if digits in _UNSPECIFIED_DATE_TIMES:
+		return None
+	if not digits.isdigit():
+		raise ValueError("invalid datetime ({})".format(digits))
+	return datetime.datetime(int(digits[0:4]), int(digits[4:6]), int(digits[6:8]), int(digits[8:10]), int(digits[10:12]), int(digits[12:14]))
+
+def _both_endian_match(data, offset, size, value):
+	# the big endian copy follows the little endian one (already unpacked as value)
+	return int.from_bytes(data[offset + size:offset + 2 * size], "big") == value
 
 class ISO9660(common.FileSystem, common.Dumpeable):
+	VOLUME_DESCRIPTOR_READ_BLOCKS = 8
+	
 	def __init__(self, image, base_offset=0):
 		self._image = image
 		self._base_offset = base_offset
+		# metadata reads (descriptors, path tables, directories) are usually repeated, the recent ones
+		# are kept; file contents are read straight from the image so they don't evict them
+		self._metadata_image = CachedImage(image, 256)
 	
 		self._system_area = self.read_blocks(self._base_offset, 16)
 		
 		self._volume_descriptors = []
 		index = 0
+		first = 0
+		sectors = b""
 		while True:
-			vd = VolumeDescriptor.from_sector(self.read_blocks(self._base_offset + 16 + index, 1), self)
+			if (index - first) * self.block_size >= len(sectors):
+				first = index
+				sectors = self._read_volume_descriptor_sectors(self._base_offset + 16 + index)
+			offset = (index - first) * self.block_size
+			vd = VolumeDescriptor.from_sector(sectors[offset:offset + self.block_size], self)
 			self._volume_descriptors.append(vd)
 			if isinstance(vd, VolumeDescriptorSetTerminator):
 				break
 			index += 1
 	
+	def _read_volume_descriptor_sectors(self, address):
+		# discs have a few descriptors, they are usually all read at once
+		try:
+			return self.read_metadata_blocks(address, self.VOLUME_DESCRIPTOR_READ_BLOCKS)
+		except IOError:
+			# a bad block after the terminator must not prevent reading the descriptors
+			return self.read_metadata_blocks(address, 1)
+	
+	@classmethod
+	def probe(cls, image, base_offset=0):
+		if image.read_blocks(base_offset + 16, 1)[1:6] != b"CD001":
+			return None
+		return cls(image, base_offset)
+	
 	@property
 	def block_size(self):
 		return 2048
@@ -88,24 +130,45 @@ class ISO9660(common.FileSystem, common.Dumpeable):
 	def read_blocks(self, address, count=1):
 		return self._image.read_blocks(address, count)
 	
-	def read_extent(self, address, size):
+	def read_metadata_blocks(self, address, count=1):
+		return self._metadata_image.read_blocks(address, count)
+	
+	def _read_extent(self, read_blocks, address, size):
 		remainder = (-size) % self._image.block_size
-		data = self.read_blocks(address, (size // self._image.block_size) + (1 if size % self._image.block_size != 0 else 0))
+		data = read_blocks(address, (size // self._image.block_size) + (1 if size % self._image.block_size != 0 else 0))
 		return data if remainder == 0 else data[:-remainder]
 		
+	def read_extent(self, address, size):
+		return self._read_extent(self.read_blocks, address, size)
+	
+	def read_metadata_extent(self, address, size):
+		return self._read_extent(self.read_metadata_blocks, address, size)
+		
 	def read_extent_as_raw(self, address, size):
 		if size % self._image.block_size != 0:
 			raise ValueError("size must match whole blocks")
 		return self._image.read_blocks_raw(address, size // self._image.block_size)
+	
+	def prefetch_blocks(self, address, count=1):
+		self._image.prefetch(address, count)
 
 	@property
 	def partitions(self):
 		return tuple(filter(lambda vd: isinstance(vd, common.Partition), self._volume_descriptors))
 			
+	def dump_iter(self, indent=0):
+		yield self._TAB * indent + "ISO9660:\n" + \
+			self._TAB * indent + "- Volume Descriptors:\n"
+		separator = ""
+		for vd in self._volume_descriptors:
+			yield separator
+			yield from vd.dump_iter(indent + 1)
+			separator = "\n"
+		
 	def dump(self, indent=0):
-		return self._TAB * indent + "ISO9660:\n" + \
-			self._TAB * indent + "- Volume Descriptors:\n" + \
-			"\n".join([vd.dump(indent + 1) for vd in self._volume_descriptors])
+		return "".join(self.dump_iter(indent))
+
+_VOLUME_DESCRIPTOR = struct.Struct("B5sB2041s")
 
 class VolumeDescriptor(common.Dumpeable):
 	def __init__(self, _type, identifier, version, data, image):
@@ -117,21 +180,23 @@ class VolumeDescriptor(common.Dumpeable):
 		
 	@classmethod
 	def from_sector(cls, sector, image):
-		_type, identifier, version, data = _unpack("B5sB2041s", sector)
-		for c in cls.__subclasses__():
-			if c.get_type() == _type:
-				return c(_type, identifier, version, data, image)
+		_type, identifier, version, data = _VOLUME_DESCRIPTOR.unpack(sector)
+		c = _VOLUME_DESCRIPTORS.get(_type)
+		if c != None:
+			return c(_type, identifier, version, data, image)
 		raise ValueError("unknown volume descriptor type ({})".format(_type))
 		
 	@classmethod
 	def get_type(cls):
 		raise NotImplementedError
 		
+_BOOT_RECORD = struct.Struct("32s32s")
+
 class BootRecordVolumeDescriptor(VolumeDescriptor):
 	def __init__(self, _type, identifier, version, data, image):
 		super().__init__(_type, identifier, version, data, image)
 		
-		self._boot_system_identifier, self._boot_identifier = _unpack("32s32s", data[:64])
+		self._boot_system_identifier, self._boot_identifier = _BOOT_RECORD.unpack_from(data, 0)
 		self._custom_data = data[64:]
 		
 		if self._identifier != b"CD001":
@@ -150,19 +215,29 @@ class BootRecordVolumeDescriptor(VolumeDescriptor):
 			self._TAB * indent + "- Boot Identifier: " + repr(self._boot_identifier) + "\n" + \
 			self._TAB * indent + "- Custom: " + self._custom.hex() + "\n"
 
+_ZERO8 = b"\x00" * 8
+_ZERO32 = b"\x00" * 32
+# UCS-2 level 1, 2 and 3
+_JOLIET_ESCAPE_SEQUENCES = frozenset((b"\x25\x2f\x40".ljust(32, b"\x00"), b"\x25\x2f\x43".ljust(32, b"\x00"), b"\x25\x2f\x45".ljust(32, b"\x00")))
+
+# big endian copies are skipped (they are validated against the little endian ones) and the type M
+# path table locations are kept as raw bytes, so the descriptor can be unpacked with a single struct
+_PARTITION_VOLUME_DESCRIPTOR = struct.Struct("<B32s32s8sI4x32sH2xH2xH2xI4xII4s4s34s128s128s128s128s37s37s37s17s17s17s17sBB512s653s")
+
 class PartitionVolumeDescriptor(common.Partition):
 	def __init__(self, identifier, version, data, image):
 		self._image = image
 		
-		volume_flags, system_identifier, volume_identifier, unused1, self._volume_space_size, volume_space_size_msb, self._escape_sequences, \
-			self._volume_set_size, volume_set_size_msb, self._volume_sequence_number, volume_sequence_number_msb, \
-			self._logical_block_size, logical_block_size_msb, self._path_table_size, path_table_size_msb, \
-			type_l_path_table_location, type_l_optional_path_table_location, type_m_path_table_location, type_m_optional_path_table_location, \
-			root_directory_entry, volume_set_identifier, publisher_identifier, data_preparer_identifier, application_identifier, \
-			copyright_file_identifier, abstract_file_identifier, bibliographic_file_identifier, \
-			volume_creation_datetime, volume_modification_datetime, volume_expiration_datetime, volume_effective_datetime, \
+		# only what is needed to validate the descriptor, label it and walk its tree is parsed here,
+		# the path tables, the other identifiers and the dates are parsed when first used
+		volume_flags, self._raw_system_identifier, volume_identifier, unused1, self._volume_space_size, self._escape_sequences, \
+			self._volume_set_size, self._volume_sequence_number, self._logical_block_size, self._path_table_size, \
+			self._type_l_path_table_location, type_l_optional_path_table_location, self._type_m_path_table_location, type_m_optional_path_table_location, \
+			root_directory_entry, self._raw_volume_set_identifier, self._raw_publisher_identifier, self._raw_data_preparer_identifier, self._raw_application_identifier, \
+			self._raw_copyright_file_identifier, self._raw_abstract_file_identifier, self._raw_bibliographic_file_identifier, \
+			self._raw_volume_creation_datetime, self._raw_volume_modification_datetime, self._raw_volume_expiration_datetime, self._raw_volume_effective_datetime, \
 			file_structure_version, unused4, self._application_data, self._reserved = \
-			_unpack("B32s32s8s<I>I32s<H>H<H>H<H>H<I>I<I<I>I>I34s128s128s128s128s37s37s37s17s17s17s17sBB512s653s", data)
+			_PARTITION_VOLUME_DESCRIPTOR.unpack(data)
 		
 		if identifier != b"CD001":
 			raise ValueError("invalid identifier for primary/secondary volume descriptor")
@@ -177,51 +252,27 @@ class PartitionVolumeDescriptor(common.Partition):
 		else:
 			raise ValueError("invalid volume flags for primary/secondary volume descriptor ({})".format(volume_flags))
 		
-		self._system_identifier = _to_string(system_identifier, self.encoding)
 		self._volume_identifier = _to_string(volume_identifier, self.encoding)
 
-		if unused1 != b"\x00" * 8:
+		if unused1 != _ZERO8:
 			raise ValueError("invalid unused1 for primary/secondary volume descriptor ({})".format(unused1))
 		
-		if self._volume_space_size != volume_space_size_msb:
+		if not _both_endian_match(data, 73, 4, self._volume_space_size):
 			raise ValueError("volume space size fields do not match for primary volume descriptor")
 		
-		if self._volume_set_size != volume_set_size_msb:
+		if not _both_endian_match(data, 113, 2, self._volume_set_size):
 			raise ValueError("volume set size fields do not match for primary volume descriptor")
 
-		if self._volume_sequence_number != volume_sequence_number_msb:
+		if not _both_endian_match(data, 117, 2, self._volume_sequence_number):
 			raise ValueError("volume sequence number fields do not match for primary volume descriptor")
 
-		if self._logical_block_size != logical_block_size_msb:
+		if not _both_endian_match(data, 121, 2, self._logical_block_size):
 			raise ValueError("logical block size fields do not match for primary volume descriptor")
 
-		if self._path_table_size != path_table_size_msb:
+		if not _both_endian_match(data, 125, 4, self._path_table_size):
 			raise ValueError("path table size fields do not match for primary volume descriptor")
 			
-		self._type_l_path_table = self._read_path_table(True, type_l_path_table_location, self._path_table_size)
-		self._type_m_path_table = self._read_path_table(False, type_m_path_table_location, self._path_table_size)
-			
 		self._root_directory_record = DirectoryRecord(root_directory_entry, self.encoding)
-			
-		self._volume_set_identifier = _to_string(volume_set_identifier, self.encoding)
-		self._publisher_identifier = _to_string(publisher_identifier, self.encoding)
-		self._data_preparer_identifier = _to_string(data_preparer_identifier, self.encoding)
-		self._application_identifier = _to_string(application_identifier, self.encoding)
-		self._data_preparer_identifier = _to_string(data_preparer_identifier, self.encoding)
-		self._copyright_file_identifier = _to_string(copyright_file_identifier, self.encoding)
-		self._abstract_file_identifier = _to_string(abstract_file_identifier, self.encoding)
-		self._bibliographic_file_identifier = _to_string(bibliographic_file_identifier, self.encoding)
-
-		self._volume_create_date = _parse_date_time(volume_creation_datetime)
-		self._volume_modification_date = _parse_date_time(volume_modification_datetime)
-		if volume_expiration_datetime != b"\x00" * 17:
-			self._volume_expiration_date = _parse_date_time(volume_expiration_datetime)
-		else:
-			self._volume_expiration_date = None
-		if volume_effective_datetime != b"\x00" * 17:
-			self._volume_effective_date = _parse_date_time(volume_effective_datetime)
-		else:
-			self._volume_effective_date = None
 		
 		if file_structure_version != 1:
 			raise ValueError("invalid file structure version for primary volume descriptor")
@@ -232,14 +283,72 @@ class PartitionVolumeDescriptor(common.Partition):
 	@property
 	def encoding(self):
 		raise NotImplementedError
+	
+	@functools.cached_property
+	def _type_l_path_table(self):
+		return self._read_path_table(True, self._type_l_path_table_location, self._path_table_size)
+	
+	@functools.cached_property
+	def _type_m_path_table(self):
+		return self._read_path_table(False, int.from_bytes(self._type_m_path_table_location, "big"), self._path_table_size)
+	
+	@functools.cached_property
+	def _system_identifier(self):
+		return _to_string(self._raw_system_identifier, self.encoding)
+	
+	@functools.cached_property
+	def _volume_set_identifier(self):
+		return _to_string(self._raw_volume_set_identifier, self.encoding)
+	
+	@functools.cached_property
+	def _publisher_identifier(self):
+		return _to_string(self._raw_publisher_identifier, self.encoding)
+	
+	@functools.cached_property
+	def _data_preparer_identifier(self):
+		return _to_string(self._raw_data_preparer_identifier, self.encoding)
+	
+	@functools.cached_property
+	def _application_identifier(self):
+		return _to_string(self._raw_application_identifier, self.encoding)
+	
+	@functools.cached_property
+	def _copyright_file_identifier(self):
+		return _to_string(self._raw_copyright_file_identifier, self.encoding)
+	
+	@functools.cached_property
+	def _abstract_file_identifier(self):
+		return _to_string(self._raw_abstract_file_identifier, self.encoding)
+	
+	@functools.cached_property
+	def _bibliographic_file_identifier(self):
+		return _to_string(self._raw_bibliographic_file_identifier, self.encoding)
+	
+	@functools.cached_property
+	def _volume_create_date(self):
+		return _parse_date_time(self._raw_volume_creation_datetime)
+	
+	@functools.cached_property
+	def _volume_modification_date(self):
+		return _parse_date_time(self._raw_volume_modification_datetime)
+	
+	@functools.cached_property
+	def _volume_expiration_date(self):
+		return _parse_date_time(self._raw_volume_expiration_datetime)
+	
+	@functools.cached_property
+	def _volume_effective_date(self):
+		return _parse_date_time(self._raw_volume_effective_datetime)
 
 	def _read_path_table(self, lsb, location, size):
-		data = self._image.read_extent(location, size)
+		data = memoryview(self._image.read_metadata_extent(location, size))
 		path_table = []
-		while len(data) > 0 and data[0] > 0:
-			entry = PathTableEntry(lsb, data, self.encoding)
+		offset = 0
+		# a table size cutting an entry header ends the table
+		while offset + 8 <= len(data) and data[offset] > 0:
+			entry = PathTableEntry(lsb, data[offset:], self.encoding)
 			path_table.append(entry)
-			data = data[8 + entry._identifier_length + (entry._identifier_length & 0x01):]
+			offset += 8 + entry._identifier_length + (entry._identifier_length & 0x01)
 		return path_table
 
 	@property
@@ -248,35 +357,53 @@ class PartitionVolumeDescriptor(common.Partition):
 	
 	@property
 	def root_directory(self):
+		if not "_type_l_path_table" in self.__dict__:
+			# the path table lists every directory, let the kernel start reading their extents
+			# the first time the tree is going to be walked (it is only a hint, the walk doesn't
+			# need the path table)
+			try:
+				for entry in self._type_l_path_table:
+					self._image.prefetch_blocks(entry._extent)
+			except (IOError, ValueError, struct.error):
+				pass
 		return Directory(self._root_directory_record, self._image)
 		
-	def dump(self, indent=0):
-		return self._TAB * indent + "{} ({}):\n".format(self.__class__.__name__, self.type) + \
-			self._TAB * indent + "- System Identifier: {}\n".format(repr(self._system_identifier)) + \
-			self._TAB * indent + "- Volume Identifier: {}\n".format(repr(self._volume_identifier)) + \
-			self._TAB * indent + "- Volume Space Size: {} blocks\n".format(self._volume_space_size) + \
-			self._TAB * indent + "- Volume Set Size: {} discs\n".format(self._volume_set_size) + \
-			self._TAB * indent + "- Volume Sequence Number: {}\n".format(self._volume_sequence_number) + \
-			self._TAB * indent + "- Logical Block Size: {} bytes\n".format(self._logical_block_size) + \
-			self._TAB * indent + "- Path Table Size: {} bytes\n".format(self._path_table_size) + \
-			self._TAB * indent + "- Type-L Path Table:\n" + \
-			"\n".join([entry.dump(indent + 1) for entry in self._type_l_path_table]) + "\n" + \
-			self._TAB * indent + "- Type-M Path Table:\n" + \
-			"\n".join([entry.dump(indent + 1) for entry in self._type_m_path_table]) + "\n" + \
-			self._TAB * indent + "- Root Directory Entry:\n" + \
+	def dump_iter(self, indent=0):
+		tab = self._TAB * indent
+		yield tab + "{} ({}):\n".format(self.__class__.__name__, self.type) + \
+			tab + "- System Identifier: {}\n".format(repr(self._system_identifier)) + \
+			tab + "- Volume Identifier: {}\n".format(repr(self._volume_identifier)) + \
+			tab + "- Volume Space Size: {} blocks\n".format(self._volume_space_size) + \
+			tab + "- Volume Set Size: {} discs\n".format(self._volume_set_size) + \
+			tab + "- Volume Sequence Number: {}\n".format(self._volume_sequence_number) + \
+			tab + "- Logical Block Size: {} bytes\n".format(self._logical_block_size) + \
+			tab + "- Path Table Size: {} bytes\n".format(self._path_table_size)
+		# the path tables can be long, their entries are yielded one by one
+		for name, path_table in (("Type-L", self._type_l_path_table), ("Type-M", self._type_m_path_table)):
+			yield tab + "- {} Path Table:\n".format(name)
+			separator = ""
+			for entry in path_table:
+				yield separator
+				yield entry.dump(indent + 1)
+				separator = "\n"
+			yield "\n"
+		yield tab + "- Root Directory Entry:\n" + \
 			self._root_directory_record.dump(indent + 1) + "\n" + \
-			self._TAB * indent + "- Volume Set Identifier: {}\n".format(repr(self._volume_set_identifier)) + \
-			self._TAB * indent + "- Volume Set Identifier: {}\n".format(repr(self._volume_set_identifier)) + \
-			self._TAB * indent + "- Publisher Identifier: {}\n".format(repr(self._publisher_identifier)) + \
-			self._TAB * indent + "- Data Preparer Identifier: {}\n".format(repr(self._data_preparer_identifier)) + \
-			self._TAB * indent + "- Application Identifier: {}\n".format(repr(self._application_identifier)) + \
-			self._TAB * indent + "- Copyright File Identifier: {}\n".format(repr(self._copyright_file_identifier)) + \
-			self._TAB * indent + "- Abstract File Identifier: {}\n".format(repr(self._abstract_file_identifier)) + \
-			self._TAB * indent + "- Bibliographic File Identifier: {}\n".format(repr(self._bibliographic_file_identifier)) + \
-			self._TAB * indent + "- Volume Creation: {}\n".format(self._volume_create_date.isoformat()) + \
-			self._TAB * indent + "- Volume Modification: {}\n".format(self._volume_modification_date.isoformat()) + \
-			self._TAB * indent + "- Volume Expiration: {}\n".format(self._volume_expiration_date.isoformat() if self._volume_expiration_date != None else "not specified") + \
-			self._TAB * indent + "- Volume Effective: {}\n".format(self._volume_effective_date.isoformat() if self._volume_effective_date != None else "not specified")
+			tab + "- Volume Set Identifier: {}\n".format(repr(self._volume_set_identifier)) + \
+			tab + "- Volume Set Identifier: {}\n".format(repr(self._volume_set_identifier)) + \
+			tab + "- Publisher Identifier: {}\n".format(repr(self._publisher_identifier)) + \
+			tab + "- Data Preparer Identifier: {}\n".format(repr(self._data_preparer_identifier)) + \
+			tab + "- Application Identifier: {}\n".format(repr(self._application_identifier)) + \
+			tab + "- Copyright File Identifier: {}\n".format(repr(self._copyright_file_identifier)) + \
+			tab + "- Abstract File Identifier: {}\n".format(repr(self._abstract_file_identifier)) + \
+			tab + "- Bibliographic File Identifier: {}\n".format(repr(self._bibliographic_file_identifier)) + \
+			tab + "- Volume Creation: {}\n".format(self._volume_create_date.isoformat() if self._volume_create_date != None else "not specified") + \
+			tab + "- Volume Modification: {}\n".format(self._volume_modification_date.isoformat() if self._volume_modification_date != None else "not specified") + \
+			tab + "- Volume Expiration: {}\n".format(self._volume_expiration_date.isoformat() if self._volume_expiration_date != None else "not specified") + \
+			tab + "- Volume Effective: {}\n".format(self._volume_effective_date.isoformat() if self._volume_effective_date != None else "not specified")
+		
+	def dump(self, indent=0):
+		return "".join(PartitionVolumeDescriptor.dump_iter(self, indent))
 
 class PrimaryVolumeDescriptor(VolumeDescriptor, PartitionVolumeDescriptor):
 	def __init__(self, _type, identifier, version, data, image):
@@ -286,7 +413,7 @@ class PrimaryVolumeDescriptor(VolumeDescriptor, PartitionVolumeDescriptor):
 		if self._additional_escape_sequences:
 			raise ValueError("invalid volume flags for primary volume descriptor")
 
-		if self._escape_sequences != b"\x00" * 32:
+		if self._escape_sequences != _ZERO32:
 			raise ValueError("invalid escape sequences for primary volume descriptor")
 
 	@classmethod
@@ -301,6 +428,9 @@ class PrimaryVolumeDescriptor(VolumeDescriptor, PartitionVolumeDescriptor):
 	def type(self):
 		return "iso9660"
 
+	def dump_iter(self, indent=0):
+		return PartitionVolumeDescriptor.dump_iter(self, indent)
+
 	def dump(self, indent=0):
 		return PartitionVolumeDescriptor.dump(self, indent)
 
@@ -312,7 +442,7 @@ class SupplementaryVolumeDescriptor(VolumeDescriptor, PartitionVolumeDescriptor)
 		if self._additional_escape_sequences:
 			raise ValueError("additional escape sequences for secondary volume descriptor are not supported")
 
-		if self._escape_sequences not in (b"\x25\x2f\x40".ljust(32, b"\x00"), b"\x25\x2f\x43".ljust(32, b"\x00"), b"\x25\x2f\x45".ljust(32, b"\x00")):
+		if self._escape_sequences not in _JOLIET_ESCAPE_SEQUENCES:
 			raise ValueError("not supported escape sequences for secondary volume descriptor")
 
 	@classmethod
@@ -327,6 +457,9 @@ class SupplementaryVolumeDescriptor(VolumeDescriptor, PartitionVolumeDescriptor)
 	def type(self):
 		return "joliet"
 
+	def dump_iter(self, indent=0):
+		return PartitionVolumeDescriptor.dump_iter(self, indent)
+
 	def dump(self, indent=0):
 		return PartitionVolumeDescriptor.dump(self, indent)
 
@@ -346,12 +479,17 @@ class VolumeDescriptorSetTerminator(VolumeDescriptor):
 	def dump(self, indent=0):
 		return self._TAB * indent + "VolumeDescriptorSetTerminator"
 
+# volume descriptor classes by type, from_sector looks them up here
+_VOLUME_DESCRIPTORS = {c.get_type(): c for c in reversed(VolumeDescriptor.__subclasses__())}
+
+# type L (little endian) and type M (big endian) path table entries
+_PATH_TABLE_ENTRY = {True: struct.Struct("<BBIH"), False: struct.Struct(">BBIH")}
+
 class PathTableEntry(common.Dumpeable):
 	def __init__(self, lsb, data, encoding):
-		endianness = "<" if lsb else ">"
-		self._identifier_length, extended_attributes_length, self._extent, self._parent_index = _unpack(endianness + "BBIH", data[:8])
+		self._identifier_length, extended_attributes_length, self._extent, self._parent_index = _PATH_TABLE_ENTRY[lsb].unpack_from(data, 0)
 		
-		self._identifier = _to_string(data[8:8 + self._identifier_length], encoding)
+		self._identifier = _to_string(bytes(data[8:8 + self._identifier_length]), encoding)
 		
 	def dump(self, indent=0):
 		return self._TAB * indent + "PathTableEntry:\n" + \
@@ -359,16 +497,24 @@ class PathTableEntry(common.Dumpeable):
 			self._TAB * indent + "- Extent Location: {}\n".format(self._extent) + \
 			self._TAB * indent + "- Parent Directory Index: {}".format(self._parent_index)
 			
+# the big endian copies of the fields are skipped (they are validated against the little endian
+# ones), so the whole record header can be unpacked in place with a single struct
+_DIRECTORY_RECORD = struct.Struct("<BBI4xI4xBBBBBBBBBBH2xB")
+
+_RIFF_CDXA_HEADER = struct.Struct("<4sI4s4sIHHH2sB7s4sI")
+
 # TODO: merge different versions of the same file in a single instance and manage them through streams
 class DirectoryRecord(common.Dumpeable):
+	CONTENT_CHUNK_BLOCKS = 64
+	
 	def __init__(self, data, encoding):
-		self._length, self._extended_attributes_length, self._extent, extent_msb, self._data_length, data_length_msb, \
+		self._length, self._extended_attributes_length, self._extent, self._data_length, \
 			recording_datetime_year, recording_datetime_month, recording_datetime_day, recording_datetime_hours, recording_datetime_minutes, recording_datetime_seconds, recording_datetime_tz, \
-			flags, self._file_unit_size, self._interleave_gap_size, self._volume_sequence_number, volume_sequence_number_msb, self._file_indentifier_length = \
-			_unpack("BB<I>I<I>IBBBBBBBBBB<H>HB", data[:33])
+			self._flags, self._file_unit_size, self._interleave_gap_size, self._volume_sequence_number, self._file_indentifier_length = \
+			_DIRECTORY_RECORD.unpack_from(data, 0)
 		self._encoding = encoding
 		
-		self._identifier = data[33:33 + self._file_indentifier_length]
+		self._identifier = bytes(data[33:33 + self._file_indentifier_length])
 		
 		if self._length == 0:
 			raise ValueError("invalid length for directory record ({})".format(self._identifier))
@@ -376,73 +522,100 @@ class DirectoryRecord(common.Dumpeable):
 		if self._length + self._extended_attributes_length > len(data):
 			raise ValueError("data length mismatch for directory record")
 		
-		if self._extent != extent_msb:
+		if not _both_endian_match(data, 2, 4, self._extent):
 			raise ValueError("extent location fields do not match for directory record")
 			
-		if self._data_length != data_length_msb:
+		if not _both_endian_match(data, 10, 4, self._data_length):
 			raise ValueError("data length fields do not match for directory record")
 			
-		if self._volume_sequence_number != volume_sequence_number_msb:
+		if not _both_endian_match(data, 28, 2, self._volume_sequence_number):
 			raise ValueError("volume sequence number fields do not match for directory record")
 			
-		self._recording_date_time = datetime.datetime(recording_datetime_year + 1900, recording_datetime_month, recording_datetime_day, recording_datetime_hours, recording_datetime_minutes, recording_datetime_seconds)
+		self._recording = (recording_datetime_year + 1900, recording_datetime_month, recording_datetime_day, recording_datetime_hours, recording_datetime_minutes, recording_datetime_seconds)
 		
-		self._is_hidden = flags & 0x01 == 0x01
-		self._is_directory = flags & 0x02 == 0x02
-		self._is_associated_file = flags & 0x04 == 0x04
-		self._contains_file_format_information = flags & 0x08 == 0x08
-		self._contains_persmissions = flags & 0x10 == 0x10
-		self._is_final = flags & 0x80 == 0x80
+		# the flags checked for every record are kept, the rest are only tested when dumped
+		self._is_directory = self._flags & 0x02 != 0
+		self._is_final = self._flags & 0x80 != 0
+		
+	@property
+	def _is_hidden(self):
+		return self._flags & 0x01 != 0
+	
+	@property
+	def _is_associated_file(self):
+		return self._flags & 0x04 != 0
+	
+	@property
+	def _contains_file_format_information(self):
+		return self._flags & 0x08 != 0
+	
+	@property
+	def _contains_persmissions(self):
+		return self._flags & 0x10 != 0
 		
 	@property
 	def name(self):
-		return _to_string(self._identifier.split(b";", 2)[0], self._encoding)
+		return _decode_name(self._identifier, self._encoding)
 	
 	@property
 	def is_directory(self):
 		return self._is_directory
 		
+	@property
+	def recording_date_time(self):
+		return datetime.datetime(*self._recording)
+		
 	def get_childs(self, image):
-		childs = []
 		if not self._is_directory:
 			raise ValueError("not a directory")
 		
-		data = image.read_extent(self._extent, self._data_length)
-		# skip the . and .. entries
-		data = data[data[0] + data[1]:]
-		data = data[data[0] + data[1]:]
-		# TODO: take into account directory records cannot cross block boundaries
-		while len(data) > 0 and data[0] > 0:
-			record = DirectoryRecord(data, self._encoding)
-			childs.append(record)
-			if record._is_final:
-				break
-			data = data[record._length + record._extended_attributes_length:]
-		
-		return childs
+		return _parse_directory_records(image.read_metadata_extent(self._extent, self._data_length), self._encoding)
 		
 	def get_content(self, image, stream=0):
+		return b"".join(self.iter_content(image, stream))
+		
+	def iter_content(self, image, stream=0):
 		if self._is_directory:
 			raise TypeError("not a file")
 		if stream != 0:
 			raise ValueError("only stream 0 available")
 		
+		return self._iter_content(image)
+	
+	def _iter_content(self, image):
+		# the content is read in chunks, so it never has to be held whole in memory
+		chunk_size = self.CONTENT_CHUNK_BLOCKS * image.block_size
+		if self._data_length > chunk_size:
+			# let the kernel start reading the rest of the file while the first chunk is used
+			image.prefetch_blocks(self._extent, (self._data_length + image.block_size - 1) // image.block_size)
 		try:
-			return image.read_extent(self._extent, self._data_length)
+			chunk = image.read_extent(self._extent, min(chunk_size, self._data_length))
 		except Exception as e:
-			# Wrap CDXA files (having Mode 2 Form 2 sectors) into a RIFF container
-			# See https://github.com/microsoft/Windows-driver-samples/blob/7895dd22785ddba5e973662ed942be3b3452b89d/filesys/cdfs/cddata.c#L150
-			#     https://github.com/kicker12/scripts/blob/dfe8613ed64a89120c04782ae388d54174c3b663/psxc-media/MediaInfoLib/Source/MediaInfo/Multiple/File_Cdxa.cpp#L329	
-			data = image.read_extent_as_raw(self._extent, self._data_length)
-			header = struct.pack("<4sI4s4sIHHH2sB7s4sI", b"RIFF", 36 + len(data), b"CDXA", b"fmt ", 16, 0, 0, 0x1111, b"XA", 1, b"\x00" * 7, b"data", len(data))
-			return header + data
+			yield from self._iter_cdxa_content(image, chunk_size)
+			return
+		yield chunk
+		for offset in range(chunk_size, self._data_length, chunk_size):
+			yield image.read_extent(self._extent + offset // image.block_size, min(chunk_size, self._data_length - offset))
+			
+	def _iter_cdxa_content(self, image, chunk_size):
+		# Wrap CDXA files (having Mode 2 Form 2 sectors) into a RIFF container
+		# See https://github.com/microsoft/Windows-driver-samples/blob/7895dd22785ddba5e973662ed942be3b3452b89d/filesys/cdfs/cddata.c#L150
+		#     https://github.com/kicker12/scripts/blob/dfe8613ed64a89120c04782ae388d54174c3b663/psxc-media/MediaInfoLib/Source/MediaInfo/Multiple/File_Cdxa.cpp#L329	
+		chunks = (image.read_extent_as_raw(self._extent + offset // image.block_size, min(chunk_size, self._data_length - offset)) \
+			for offset in range(0, self._data_length, chunk_size))
+		chunk = next(chunks)
+		# the header holds the size of the whole raw data, known from the size of the first raw chunk
+		size = len(chunk) // (min(chunk_size, self._data_length) // image.block_size) * (self._data_length // image.block_size)
+		yield _RIFF_CDXA_HEADER.pack(b"RIFF", 36 + size, b"CDXA", b"fmt ", 16, 0, 0, 0x1111, b"XA", 1, b"\x00" * 7, b"data", size)
+		yield chunk
+		yield from chunks
 				
 	def dump(self, indent=0):
 		return self._TAB * indent + "DirectoryRecord:\n" + \
 			self._TAB * indent + "- Identifier: {}\n".format(self.name) + \
 			self._TAB * indent + "- Extent Location: {}\n".format(self._extent) + \
 			self._TAB * indent + "- Data Length: {}\n".format(self._data_length) + \
-			self._TAB * indent + "- Recorded: {}\n".format(self._recording_date_time.isoformat()) + \
+			self._TAB * indent + "- Recorded: {}\n".format(self.recording_date_time.isoformat()) + \
 			self._TAB * indent + "- Hidden: {}\n".format(repr(self._is_hidden)) + \
 			self._TAB * indent + "- Directory: {}\n".format(repr(self._is_directory)) + \
 			self._TAB * indent + "- Associated File: {}\n".format(repr(self._is_associated_file)) + \
@@ -454,6 +627,20 @@ class DirectoryRecord(common.Dumpeable):
 			self._TAB * indent + "- Volume Sequence Number: {}\n".format(self._volume_sequence_number) + \
 			self._TAB * indent + "- Extended Attributes Length: {}".format(self._extended_attributes_length)
 
+def _parse_directory_records(data, encoding):
+	# records are built as they are iterated, walking the extent with an offset
+	data = memoryview(data)
+	# skip the . and .. entries
+	offset = data[0] + data[1]
+	offset += data[offset] + data[offset + 1]
+	# TODO: take into account directory records cannot cross block boundaries
+	while offset < len(data) and data[offset] > 0:
+		record = DirectoryRecord(data[offset:], encoding)
+		yield record
+		if record._is_final:
+			break
+		offset += record._length + record._extended_attributes_length
+
 class Directory(common.Directory):
 	def __init__(self, record, image):
 		self._record = record
@@ -463,14 +650,19 @@ class Directory(common.Directory):
 	def name(self):
 		return self._record.name
 
+	@functools.cached_property
+	def _child_records(self):
+		# the extent is read and parsed once, for both the directories and the files
+		return tuple(self._record.get_childs(self._image))
+
 	def _get_child_records(self, directories, wrapper):
-		return tuple(map(lambda record: wrapper(record, self._image), filter(lambda record: record.is_directory == directories, self._record.get_childs(self._image))))
+		return tuple([wrapper(record, self._image) for record in self._child_records if record._is_directory == directories])
 	
-	@property
+	@functools.cached_property
 	def directories(self):
 		return self._get_child_records(True, Directory)
 		
-	@property
+	@functools.cached_property
 	def files(self):
 		return self._get_child_records(False, File)
 		
@@ -492,6 +684,9 @@ class File(common.File):
 	
 	def get_content(self, stream=0):
 		return self._record.get_content(self._image, stream)
+	
+	def iter_content(self, stream=0):
+		return self._record.iter_content(self._image, stream)
 
 	def dump(self, indent=0):
 		return self._record.dump(indent)
@@ -28,39 +28,80 @@
 
 import argparse
 import os
-import traceback
 import dumpdisc
 import dumpdisc.image
 
-def extract(partition, destination):
-	def _extract(directory, destination):
+# files are written once from start to end (O_SEQUENTIAL only exists, and matters, on windows)
+_WRITE_FLAGS = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0) | getattr(os, "O_SEQUENTIAL", 0)
+
+def _write_content(name, chunks):
+	# the content is written as it is read, a partially written file is removed on errors
+	# when it was created here (one already there, like an earlier version, is never removed)
+	try:
+		fd = os.open(name, _WRITE_FLAGS | os.O_EXCL, 0o666)
+		created = True
+	except FileExistsError:
+		fd = os.open(name, _WRITE_FLAGS, 0o666)
+		created = False
+	try:
+		with open(fd, "wb", buffering=1 << 20) as fp:
+			for chunk in chunks:
+				fp.write(chunk)
+	except Exception:
+		if created:
+			os.remove(name)
+		raise
+
+def _extract_stream(f, stream, name):
+	try:
+		_write_content(name, f.iter_content(stream))
+	except Exception as e:
+		import traceback
+		traceback.print_exc()
+		print("ERROR: couldn't extract file {} ({})".format(name, str(e)))
+
+def _extract_after(previous, function, *args):
+	# writes to the same name (versions of a file) are done in order, as when extracting serially
+	if previous != None:
+		previous.result()
+	function(*args)
+
+def extract(partition, destination, jobs=1):
+	def _extract(directory, destination, submit):
+		# destination with a single trailing separator, the names are appended to it
+		prefix = os.path.join(destination, "")
 		for d in directory.directories:
-			name = os.path.join(destination, d.name)
+			name = prefix + d.name
 			print("Creating directory {}".format(name))
 			os.mkdir(name)
-			_extract(d, name)
+			_extract(d, name, submit)
 		for f in directory.files:
-			name = os.path.join(destination, f.name.strip())
-			try:
-				print("Extracting file {}".format(name))
-				data = f.get_content(f.streams[0])
-				with open(name, "wb") as fp:
-					fp.write(data)
-			except Exception as e:
-				traceback.print_exc()
-				print("ERROR: couldn't extract file {} ({})".format(name, str(e)))
+			name = prefix + f.name.strip()
+			print("Extracting file {}".format(name))
+			submit(_extract_stream, f, f.streams[0], name)
 			for stream in f.streams[1:]:
-				extra_name = name + ".{}".format(stream)
-				try:
-					print("Extracting file {} for extra stream {}".format(name, stream))
-					data = f.get_content(stream)
-					with open(extra_name, "wb") as fp:
-						fp.write(data)			
-				except Exception as e:
-					traceback.print_exc()
-					print("ERROR: couldn't extract file {} ({})".format(extra_name, str(e)))
-	_extract(partition.root_directory, destination)
+				print("Extracting file {} for extra stream {}".format(name, stream))
+				submit(_extract_stream, f, stream, name + ".{}".format(stream))
+	
+	if jobs == 1:
+		_extract(partition.root_directory, destination, lambda function, *args: function(*args))
+		return
+	# directories are still created in order by the walk, the files are written by a pool of threads
+	# (image reads are serialized by the image the partitions were probed with, writes overlap them)
+	import concurrent.futures
+	with concurrent.futures.ThreadPoolExecutor(jobs) as executor:
+		futures = {}
+		def submit(function, f, stream, name):
+			futures[name] = executor.submit(_extract_after, futures.get(name), function, f, stream, name)
+		_extract(partition.root_directory, destination, submit)
+		for future in concurrent.futures.as_completed(futures.values()):
+			future.result()
 
+def _positive_int(text):
+	value = int(text)
+	if value <= 0:
+		raise argparse.ArgumentTypeError("must be greater than 0 ({})".format(text))
+	return value
 
 parser = argparse.ArgumentParser(description="Extract the files of all filesystems found in a disc image")
 group = parser.add_mutually_exclusive_group()
@@ -70,11 +111,18 @@ parser.add_argument('-b' '--badmap', help="Use specified file with bad sectors",
 group = parser.add_mutually_exclusive_group()
 group.add_argument('-s', '--start', help="Data track start sector (useful when the image is of a whole mixed CD)", type=int, dest="start", required=False, default=0)
 group.add_argument('-o', '--offset', help="Image base sector offset (useful when the image is of the data portion of a mixed CD)", type=int, dest="offset", required=False, default=0)
+parser.add_argument('-j', '--jobs', help="Number of files extracted at the same time", type=_positive_int, dest="jobs", required=False, default=1)
 parser.add_argument('image', help="Image file name", type=str)
 parser.add_argument('output_dir', help="Output directory", type=str)
 args = parser.parse_args()
 
 f = open(args.image, "rb")
+# files are extracted reading their extents in order, let the kernel read ahead more
+if hasattr(os, "posix_fadvise"):
+	try:
+		os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+	except OSError:
+		pass
 start = 0
 cls = dumpdisc.image.RawCDImage if args.rawimage else dumpdisc.image.ISOImage
 image = cls(f)
@@ -93,4 +141,4 @@ with image:
 	for partition in disc.partitions:
 		output_dir = os.path.join(args.output_dir, partition.type, partition.label)
 		os.makedirs(output_dir)
-		extract(partition, output_dir)
+		extract(partition, output_dir, args.jobs)
@@ -27,22 +27,9 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 import argparse
-import os
-import traceback
+import sys
 import dumpdisc
 import dumpdisc.image
-import dumpdisc.common
-
-def tree(partition):
-	print("> {} ({})".format(partition.label, partition.type))
-	pending = [(entry, 1) for entry in partition.root_directory.directories + partition.root_directory.files]
-	while len(pending) > 0:
-		entry, depth = pending.pop(0)
-		
-		print("{}{} {}".format(" " * 4 * depth, "+" if isinstance(entry, dumpdisc.common.Directory) else "-", entry.name))
-		
-		if isinstance(entry, dumpdisc.common.Directory):
-			pending[0:0] = map(lambda e: (e, depth + 1), entry.directories + entry.files)
 
 parser = argparse.ArgumentParser(description="Extract the files of all filesystems found in a disc image")
 group = parser.add_mutually_exclusive_group()
@@ -55,6 +42,9 @@ group.add_argument('-o', '--offset', help="Image base sector offset (useful when
 parser.add_argument('image', help="Image file name", type=str)
 args = parser.parse_args()
 
+# output is written one line per entry, avoid a write() call for each one
+sys.stdout.reconfigure(line_buffering=False)
+
 f = open(args.image, "rb")
 start = 0
 cls = dumpdisc.image.RawCDImage if args.rawimage else dumpdisc.image.ISOImage
@@ -72,4 +62,4 @@ if args.start != 0:
 with image:
 	disc = dumpdisc.Disc(image, start)
 	for partition in disc.partitions:
-		tree(partition)
+		dumpdisc.tree(partition)